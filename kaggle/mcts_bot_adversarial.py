@@ -1,5 +1,4 @@
 import chess
-import chess.polyglot
 import sys
 import os
 from typing import Callable
@@ -10,6 +9,70 @@ from collections import defaultdict
 from pprint import pprint
 from chess.polyglot import zobrist_hash
 
+# This file is submitted to Kaggle on its own, so it only imports python-chess. The helpers
+# below are small copies of the ones in src/bots.
+
+def search_outcome(board: chess.Board, moves):
+    '''
+    Same as board.outcome(), given the legal moves of board. See src/bots/terminal.py.
+    '''
+    if not moves:
+        if board.is_check():
+            return chess.Outcome(chess.Termination.CHECKMATE, not board.turn)
+        return chess.Outcome(chess.Termination.STALEMATE, None)
+    if board.is_insufficient_material():
+        return chess.Outcome(chess.Termination.INSUFFICIENT_MATERIAL, None)
+    if board.halfmove_clock >= 150:
+        return chess.Outcome(chess.Termination.SEVENTYFIVE_MOVES, None)
+    if board.is_fivefold_repetition():
+        return chess.Outcome(chess.Termination.FIVEFOLD_REPETITION, None)
+    return None
+
+class SearchStats:
+    '''
+    Counters for the last make_move(), the MCTS part of src/bots/search_stats.py.
+
+    nodes: tree nodes added
+    depth: deepest tree node
+    seldepth: deepest ply reached by a rollout
+    rollouts: simulations
+    time: seconds spent, set by stop()
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, root_ply=0):
+        # Length of the move stack at the root, to turn the move stack into a ply
+        self.root_ply = root_ply
+        self.start_time = time.time()
+        self.time = 0.0
+        self.nodes = 0
+        self.depth = 0
+        self.seldepth = 0
+        self.rollouts = 0
+
+    def stop(self):
+        self.time = time.time() - self.start_time
+
+    def elapsed(self):
+        return self.time if self.time else time.time() - self.start_time
+
+    @property
+    def nps(self):
+        elapsed = self.elapsed()
+        return int(self.nodes / elapsed) if elapsed > 0 else 0
+
+    def info_line(self, move=None):
+        '''
+        UCI style info line.
+        '''
+        line = (f"info depth {self.depth} seldepth {self.seldepth} nodes {self.nodes} nps {self.nps}"
+                f" time {int(self.elapsed() * 1000)}")
+        if move is not None:
+            line += f" pv {move.uci()}"
+        return line + f" string rollouts {self.rollouts}"
+
 # https://gibberblot.github.io/rl-notes/single-agent/mcts.html
 # https://medium.com/@_michelangelo_/monte-carlo-tree-search-mcts-algorithm-for-dummies-74b2bae53bfa
 # https://int8.io/monte-carlo-tree-search-beginners-guide/#Monte_Carlo_Tree_Search_8211_basic_concepts
@@ -38,11 +101,15 @@ class Node:
         self.parent = parent
         self.parent_action = parent_action
 
+        # The state never changes, so generate its moves and outcome once
+        self.legal_moves = list(board.legal_moves)
+        self.outcome = search_outcome(board, self.legal_moves)
+
     def is_fully_expanded(self):
-        return len(self.children) == len(list(self.state.legal_moves))
+        return len(self.children) == len(self.legal_moves)
 
     def is_terminal(self):
-        return True if self.state.outcome() else False
+        return True if self.outcome else False
     
     def get_ucb_score(self, action, exploration_constant = 0.9):
         q_value = self.qtable[hash(self.state, action)]
@@ -88,25 +155,34 @@ class Node:
         return new_child
     
     def create_new_random_child(self):
-        all_actions = set(self.state.legal_moves)
+        all_actions = set(self.legal_moves)
         explored_actions = {a[0] for a in self.children}
         unexplored_actions = all_actions - explored_actions
         action = random.choice(list(unexplored_actions))
         new_child = self.create_new_child(action)
         return action, new_child
 
-    def rollout(self, player_color):
+    def rollout(self, player_color, stats=None):
+        # stats: SearchStats to count the rollout in
         board = self.state.copy()
         depth = 0
 
-        while board.outcome() == None:
-            move = random.choice(list(board.legal_moves))
+        moves = list(board.legal_moves)
+        outcome = search_outcome(board, moves)
+        while outcome == None:
+            move = random.choice(moves)
             board.push(move)
             depth += 1
+            moves = list(board.legal_moves)
+            outcome = search_outcome(board, moves)
+
+        if stats is not None:
+            stats.rollouts += 1
+            stats.seldepth = max(stats.seldepth, len(board.move_stack) - stats.root_ply)
 
-        if board.outcome().winner == None:
+        if outcome.winner == None:
             return 0
-        elif board.outcome().winner == player_color:
+        elif outcome.winner == player_color:
             return 1 # Maybe scale by depth?
         else:
             return -1
@@ -133,6 +209,10 @@ class Agent:
         ):
         self.name = name
         self.selection_metric = selection_metric
+        # Print a UCI style info line after each move
+        self.verbose = False
+        # Filled in by the search, for the last move
+        self.stats = SearchStats()
 
     def mcts(self, board, timeout=5):
         root_node = Node(board)
@@ -141,8 +221,10 @@ class Agent:
             not_fully_expanded_node = self.select(root_node)
             if not not_fully_expanded_node.is_terminal():
                 new_action, new_child = not_fully_expanded_node.create_new_random_child()
-                reward = new_child.rollout(root_node.state.turn)
+                reward = new_child.rollout(root_node.state.turn, self.stats)
                 not_fully_expanded_node.backup(new_action, reward)
+                self.stats.nodes += 1
+                self.stats.depth = max(self.stats.depth, len(new_child.state.move_stack) - self.stats.root_ply)
             # else:
             #     # At this point, we have explored all nodes, but will still simulate to 
             #     # reduce the exploration term in the ucb score of not_fully_expanded_node
@@ -162,7 +244,12 @@ class Agent:
     def make_move(self, board, timeout=5):
         if board.outcome():
             raise Exception("Cannot make move, game is over")
-        return self.mcts(board, timeout)
+        self.stats.reset(len(board.move_stack))
+        move = self.mcts(board, timeout)
+        self.stats.stop()
+        if self.verbose:
+            print(self.stats.info_line(move=move))
+        return move
 
 # a = Agent('Test')
 # print(a.make_move(chess.Board("3r3r/2p3pp/Qp2p3/4P1P1/2p1pP1P/qk2P3/8/1KR5 w - - 0 33")))
@@ -108,4 +108,9 @@ if __name__ == "__main__":
                                       os.path.join(intermediate_path, "history.pgn"),
                                       os.path.join(intermediate_path, "results.csv"),
                                       os.path.join(intermediate_path, "elo.csv")
-                                      )
\ No newline at end of file
+                                      )
+
+    # Stop the engines and helper processes the bots started
+    for bot in bots:
+        if hasattr(bot, "close"):
+            bot.close()
\ No newline at end of file
@@ -99,6 +99,7 @@ if __name__ == "__main__":
 
     # bots += [MinimaxBot("Mybot", "src/cpp/agent")]
     # bots += [NegaMaxAgent("NegaMax")]
+    # bots += [NegaMaxAgent("NegaMax-1s", movetime=1)]
     # bots += [DMCTSAgent("Discount")]
     # bots += [StockfishBot(f"Stockfish", 5, "engines/stockfish-windows-x86-64-avx2.exe")]
     bots += [Agent("MCTS-UCB", selection_metric="ucb")]
@@ -113,4 +114,9 @@ if __name__ == "__main__":
                             os.path.join(intermediate_path, "history.pgn"),
                             os.path.join(intermediate_path, "results.csv"),
                             os.path.join(intermediate_path, "scores.csv")
-                            )
\ No newline at end of file
+                            )
+
+    # Stop the engines and helper processes the bots started
+    for bot in bots:
+        if hasattr(bot, "close"):
+            bot.close()
\ No newline at end of file
@@ -0,0 +1,171 @@
+import chess
+import chess.polyglot
+
+# Polyglot random numbers for each piece, indexed by [color][piece_type][square]
+_PIECE_KEYS = tuple(
+    (None,) + tuple(
+        tuple(chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 * ((piece - 1) * 2 + color) + i] for i in range(64))
+        for piece in chess.PIECE_TYPES)
+    for color in (chess.BLACK, chess.WHITE))
+_TURN_KEY = chess.polyglot.POLYGLOT_RANDOM_ARRAY[780]
+_HASHER = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+
+class HashedBoard(chess.Board):
+    '''
+    chess.Board that keeps its Polyglot Zobrist hash up to date on push() and pop(), so
+    zobrist_hash() is O(1) instead of rehashing every piece on the board. The key is the
+    same as chess.polyglot.zobrist_hash(board).
+
+    Pieces are hashed incrementally from the moved, captured, promoted and castled pieces.
+    Castling rights are only rehashed when they change, and the en passant file and turn
+    are added when the key is read. Any other change to the board (set_fen, set_piece_at, ...)
+    rehashes from scratch.
+
+    The full key of every position on the move stack is kept too, so is_repetition_fast() can
+    find repetitions without replaying moves.
+    '''
+
+    def __init__(self, fen=chess.STARTING_FEN, *, chess960=False):
+        self._piece_key = 0
+        self._castling_rights_key = (None, 0) # (castling rights, hash of those rights)
+        self._zobrist_stack = []
+        super().__init__(fen, chess960=chess960)
+        self.rehash()
+
+    @classmethod
+    def from_board(cls, board: chess.Board):
+        '''
+        HashedBoard with the same position and move history as board, or board itself if it
+        already is a HashedBoard.
+        '''
+        if isinstance(board, cls):
+            return board
+        hashed = cls(board.root().fen(), chess960=board.chess960)
+        for move in board.move_stack:
+            hashed.push(move)
+        return hashed
+
+    def rehash(self):
+        '''
+        Recompute the hash from scratch. Entries for moves already on the move stack are
+        dropped, so popping them rehashes too.
+        '''
+        self._piece_key = _HASHER.hash_board(self)
+        self._castling_rights_key = (self.castling_rights, _HASHER.hash_castling(self))
+        self._zobrist_stack = [None] * len(self.move_stack)
+
+    def zobrist_hash(self):
+        key = self._piece_key ^ self._castling_rights_key[1]
+        if self.ep_square:
+            key ^= _HASHER.hash_ep_square(self)
+        if self.turn == chess.WHITE:
+            key ^= _TURN_KEY
+        return key
+
+    def is_repetition_fast(self, count=3):
+        '''
+        Same as is_repetition(count), comparing the keys of earlier positions with the same side to
+        move since the last capture or pawn move.
+        '''
+        key = self.zobrist_hash()
+        seen = 1
+        stack = self._zobrist_stack
+        end = len(stack) - min(self.halfmove_clock, len(stack)) - 1
+        for i in range(len(stack) - 2, end, -2):
+            entry = stack[i]
+            if entry is None:
+                return self.is_repetition(count)
+            if entry[2] == key:
+                seen += 1
+                if seen >= count:
+                    return True
+        return False
+
+    def push(self, move: chess.Move):
+        self._zobrist_stack.append((self._piece_key, self._castling_rights_key, self.zobrist_hash()))
+
+        # Null moves only change the side to move
+        if move:
+            color = self.turn
+            keys = _PIECE_KEYS[color]
+            to_square = move.to_square
+            key = self._piece_key
+
+            if move.drop:
+                key ^= keys[move.drop][to_square]
+            else:
+                from_square = move.from_square
+                piece = self.piece_type_at(from_square)
+                key ^= keys[piece][from_square]
+
+                if piece == chess.KING and self.is_castling(move):
+                    rank_start = from_square & ~7
+                    if chess.square_file(to_square) < chess.square_file(from_square):
+                        king_to, rook_to, rook_from = rank_start + 2, rank_start + 3, rank_start
+                    else:
+                        king_to, rook_to, rook_from = rank_start + 6, rank_start + 5, rank_start + 7
+                    # Chess960 style castling moves the king onto its own rook
+                    if self.rooks & self.occupied_co[color] & chess.BB_SQUARES[to_square]:
+                        rook_from = to_square
+                    key ^= keys[chess.KING][king_to] ^ keys[chess.ROOK][rook_from] ^ keys[chess.ROOK][rook_to]
+                else:
+                    capture_square = to_square
+                    if piece == chess.PAWN and to_square == self.ep_square and self.is_en_passant(move):
+                        capture_square = to_square - 8 if color == chess.WHITE else to_square + 8
+                    captured = self.piece_type_at(capture_square)
+                    if captured:
+                        key ^= _PIECE_KEYS[not color][captured][capture_square]
+                    if move.promotion:
+                        piece = move.promotion
+                    key ^= keys[piece][to_square]
+
+            self._piece_key = key
+
+        super().push(move)
+
+        if self.castling_rights != self._castling_rights_key[0]:
+            self._castling_rights_key = (self.castling_rights, _HASHER.hash_castling(self))
+
+    def pop(self):
+        move = super().pop()
+        entry = self._zobrist_stack.pop() if self._zobrist_stack else None
+        if entry is None:
+            self.rehash()
+        else:
+            self._piece_key, self._castling_rights_key, _ = entry
+        return move
+
+    def copy(self, *, stack=True):
+        board = super().copy(stack=stack)
+        board._piece_key = self._piece_key
+        board._castling_rights_key = self._castling_rights_key
+        board._zobrist_stack = self._zobrist_stack[len(self._zobrist_stack) - len(board.move_stack):]
+        return board
+
+    def root(self):
+        board = super().root()
+        board.rehash()
+        return board
+
+def _rehash_after(name):
+    method = getattr(chess.Board, name)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.rehash()
+        return result
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ("reset", "reset_board", "clear", "clear_board", "set_fen", "set_board_fen", "set_piece_map",
+              "set_piece_at", "remove_piece_at", "set_castling_fen", "set_chess960_pos", "apply_transform",
+              "apply_mirror"):
+    setattr(HashedBoard, _name, _rehash_after(_name))
+
+def zobrist_hash(board: chess.Board):
+    '''
+    Polyglot Zobrist hash of board, read in O(1) if board is a HashedBoard.
+    '''
+    if isinstance(board, HashedBoard):
+        return board.zobrist_hash()
+    return chess.polyglot.zobrist_hash(board)
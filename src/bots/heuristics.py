@@ -1,4 +1,9 @@
 import chess
+import chess.polyglot
+import numpy as np
+from typing import Callable
+from collections import OrderedDict
+from hashed_board import zobrist_hash
 
 def piece_count(board, is_maximising_player):
     '''
@@ -160,3 +165,529 @@ def piece_square_table_eval(board: chess.Board, maximising_player):
         return result
     return -result
 
+
+# Larry Kaufman piece values indexed by piece type, from white's point of view and
+# indexed by [color][piece_type], so black pieces count negatively.
+LARRY_KAUFMAN_PIECE_VALUE = (0, 100, 325, 325, 500, 975, 0) # None, P, N, B, R, Q, K
+_MATERIAL_SCORE = (
+    tuple(-value for value in LARRY_KAUFMAN_PIECE_VALUE),
+    LARRY_KAUFMAN_PIECE_VALUE,
+)
+BISHOP_PAIR_BONUS = 50
+
+# Piece square table score from white's point of view, indexed by [color][piece_type][square].
+# Black uses the table at 63 - square, same as piece_square_table_eval.
+_PST_SCORE = (
+    (None,) + tuple(tuple(-PIECE_SQUARE_TABLE[piece][63-i] for i in range(64)) for piece in chess.PIECE_TYPES),
+    (None,) + tuple(PIECE_SQUARE_TABLE[piece] for piece in chess.PIECE_TYPES),
+)
+
+class IncrementalEvaluator:
+    '''
+    Evaluator that keeps material, bishop counts and piece square table sums up to date
+    as moves are made and unmade, so evaluating a leaf is O(1) instead of a 64 square scan.
+
+    Moves must be made with push(board, move) and pop(board) instead of board.push() and
+    board.pop(). Calling the evaluator like a heuristic, evaluator(board, maximising_player),
+    returns larry_kaufman_piece_sum if material is set, piece_square_table_eval if pst is set,
+    or their sum if both are set. If pawn_structure is set, pawn_structure_eval is added using
+    pawn_hash_table, probed with a pawn Zobrist key that is also kept up to date. If the board
+    was changed without going through the evaluator, it is rescanned on the next call.
+    '''
+
+    def __init__(self, material=True, pst=False, pawn_structure=False, pawn_hash_table=None):
+        self.material = material
+        self.pst = pst
+        self.pawn_structure = pawn_structure
+        self.pawn_hash_table = pawn_hash_table
+        self._board = None
+        self._root_ply = 0
+        self._stack = []
+
+        # All scores are from white's point of view
+        self.material_score = 0
+        self.bishop_count = [0, 0] # (black bishop, white bishop)
+        self.pst_score = 0
+        self.pawn_key = 0 # pawn_zobrist_hash of the board
+
+    def reset(self, board: chess.Board):
+        '''
+        Rescan board from scratch and start tracking it.
+        '''
+        self._board = board
+        self._root_ply = len(board.move_stack)
+        self._stack = []
+
+        self.material_score = 0
+        self.pst_score = 0
+        self.pawn_key = pawn_zobrist_hash(board)
+        for color in chess.COLORS:
+            self.bishop_count[color] = chess.popcount(board.pieces_mask(chess.BISHOP, color))
+            for piece in chess.PIECE_TYPES:
+                for i in chess.scan_forward(board.pieces_mask(piece, color)):
+                    self.material_score += _MATERIAL_SCORE[color][piece]
+                    self.pst_score += _PST_SCORE[color][piece][i]
+
+    def _in_sync(self, board: chess.Board):
+        return board is self._board and len(board.move_stack) == self._root_ply + len(self._stack)
+
+    def push(self, board: chess.Board, move: chess.Move):
+        '''
+        Update the scores with the deltas caused by move, then push it onto board.
+        '''
+        if not self._in_sync(board):
+            self.reset(board)
+        self._stack.append((self.material_score, self.bishop_count[0], self.bishop_count[1], self.pst_score,
+                            self.pawn_key))
+
+        # Null moves only change the side to move
+        if move:
+            color = board.turn
+            from_square = move.from_square
+            to_square = move.to_square
+            piece = board.piece_type_at(from_square)
+            pst = self.pst_score - _PST_SCORE[color][piece][from_square]
+
+            if piece == chess.KING and board.is_castling(move):
+                rank_start = from_square & ~7
+                if chess.square_file(to_square) < chess.square_file(from_square):
+                    king_to, rook_to, rook_from = rank_start + 2, rank_start + 3, rank_start
+                else:
+                    king_to, rook_to, rook_from = rank_start + 6, rank_start + 5, rank_start + 7
+                # Chess960 style castling moves the king onto its own rook
+                if board.rooks & board.occupied_co[color] & chess.BB_SQUARES[to_square]:
+                    rook_from = to_square
+                pst += (_PST_SCORE[color][chess.KING][king_to]
+                        - _PST_SCORE[color][chess.ROOK][rook_from]
+                        + _PST_SCORE[color][chess.ROOK][rook_to])
+            else:
+                capture_square = to_square
+                if piece == chess.PAWN and to_square == board.ep_square and board.is_en_passant(move):
+                    capture_square = to_square - 8 if color == chess.WHITE else to_square + 8
+                captured = board.piece_type_at(capture_square)
+                if captured:
+                    self.material_score -= _MATERIAL_SCORE[not color][captured]
+                    pst -= _PST_SCORE[not color][captured][capture_square]
+                    if captured == chess.BISHOP:
+                        self.bishop_count[not color] -= 1
+                    elif captured == chess.PAWN:
+                        self.pawn_key ^= _PAWN_ZOBRIST[not color][capture_square]
+                if piece == chess.PAWN:
+                    self.pawn_key ^= _PAWN_ZOBRIST[color][from_square]
+                    if not move.promotion:
+                        self.pawn_key ^= _PAWN_ZOBRIST[color][to_square]
+                if move.promotion:
+                    self.material_score += _MATERIAL_SCORE[color][move.promotion] - _MATERIAL_SCORE[color][chess.PAWN]
+                    if move.promotion == chess.BISHOP:
+                        self.bishop_count[color] += 1
+                    piece = move.promotion
+                pst += _PST_SCORE[color][piece][to_square]
+
+            self.pst_score = pst
+
+        board.push(move)
+
+    def pop(self, board: chess.Board):
+        '''
+        Pop the last move off board and restore the scores from before it was pushed.
+        '''
+        move = board.pop()
+        if self._stack and board is self._board:
+            (self.material_score, self.bishop_count[0], self.bishop_count[1], self.pst_score,
+             self.pawn_key) = self._stack.pop()
+        else:
+            self._board = None # Force a rescan on the next call
+        return move
+
+    def __call__(self, board: chess.Board, maximising_player):
+        if not self._in_sync(board):
+            self.reset(board)
+
+        result = 0
+        if self.material:
+            result += self.material_score
+            if self.bishop_count[chess.WHITE] == 2:
+                result += BISHOP_PAIR_BONUS
+            if self.bishop_count[chess.BLACK] == 2:
+                result -= BISHOP_PAIR_BONUS
+        if self.pst:
+            result += self.pst_score
+        if self.pawn_structure:
+            result += (self.pawn_hash_table or PAWN_HASH_TABLE).probe(board, self.pawn_key)
+
+        if maximising_player == chess.WHITE:
+            return result
+        return -result
+
+def search_push_pop(board: chess.Board, eval_func: Callable):
+    '''
+    Return (push, pop) functions to use instead of board.push and board.pop inside a search.
+    If eval_func is an IncrementalEvaluator, it is synced to board and updated on every move.
+
+    The bots import this module as heuristics and the scripts as bots.heuristics, which gives two
+    copies of each class, so the evaluator is recognised by its methods instead of isinstance.
+    '''
+    # Unwrap EvalCache
+    while hasattr(eval_func, "eval_func"):
+        eval_func = eval_func.eval_func
+    if all(callable(getattr(eval_func, name, None)) for name in ("reset", "push", "pop")):
+        eval_func.reset(board)
+        return (lambda move: eval_func.push(board, move)), (lambda: eval_func.pop(board))
+    return board.push, board.pop
+
+# Bitboard versions of the heuristics above. They give the same values but count material
+# with popcounts of board.pieces_mask() and only visit the set bits for the piece square table.
+# The loop versions are kept as reference implementations.
+
+PIECE_COUNT_VALUE = (0, 10, 30, 30, 50, 90, 900) # None, P, N, B, R, Q, K
+
+def piece_count_bitboard(board: chess.Board, is_maximising_player):
+    '''
+    Same as piece_count, using popcounts of the piece masks.
+    '''
+    white = board.occupied_co[chess.WHITE]
+    black = board.occupied_co[chess.BLACK]
+    result = 0
+    for piece, mask in ((chess.PAWN, board.pawns), (chess.KNIGHT, board.knights), (chess.BISHOP, board.bishops),
+                        (chess.ROOK, board.rooks), (chess.QUEEN, board.queens), (chess.KING, board.kings)):
+        result += PIECE_COUNT_VALUE[piece] * (chess.popcount(mask & white) - chess.popcount(mask & black))
+
+    if is_maximising_player:
+        return result
+    return -result
+
+def larry_kaufman_piece_sum_bitboard(board: chess.Board, maximising_player):
+    '''
+    Same as larry_kaufman_piece_sum, using popcounts of the piece masks.
+    '''
+    white = board.occupied_co[chess.WHITE]
+    black = board.occupied_co[chess.BLACK]
+    white_bishops = chess.popcount(board.bishops & white)
+    black_bishops = chess.popcount(board.bishops & black)
+
+    result = (100 * (chess.popcount(board.pawns & white) - chess.popcount(board.pawns & black))
+              + 325 * (chess.popcount(board.knights & white) - chess.popcount(board.knights & black))
+              + 325 * (white_bishops - black_bishops)
+              + 500 * (chess.popcount(board.rooks & white) - chess.popcount(board.rooks & black))
+              + 975 * (chess.popcount(board.queens & white) - chess.popcount(board.queens & black)))
+
+    # Bishop bonus
+    if white_bishops == 2:
+        result += BISHOP_PAIR_BONUS
+    if black_bishops == 2:
+        result -= BISHOP_PAIR_BONUS
+
+    if maximising_player == chess.WHITE:
+        return result
+    return -result
+
+def piece_square_table_eval_bitboard(board: chess.Board, maximising_player):
+    '''
+    Same as piece_square_table_eval, only visiting occupied squares of each piece mask.
+    '''
+    result = 0
+    for color in chess.COLORS:
+        table = _PST_SCORE[color]
+        occupied = board.occupied_co[color]
+        for piece, mask in ((chess.PAWN, board.pawns), (chess.KNIGHT, board.knights), (chess.BISHOP, board.bishops),
+                            (chess.ROOK, board.rooks), (chess.QUEEN, board.queens), (chess.KING, board.kings)):
+            piece_table = table[piece]
+            for i in chess.scan_forward(mask & occupied):
+                result += piece_table[i]
+
+    if maximising_player == chess.WHITE:
+        return result
+    return -result
+
+# Batch evaluation with NumPy. Boards are encoded as 12x64 occupancy planes, one plane per
+# (color, piece type) in the order white P, N, B, R, Q, K then black P, N, B, R, Q, K,
+# and scored with a single dot product against the weight matrices below.
+
+PLANE_ORDER = tuple((color, piece) for color in (chess.WHITE, chess.BLACK) for piece in chess.PIECE_TYPES)
+
+MATERIAL_WEIGHTS = np.array(
+    [[_MATERIAL_SCORE[color][piece]] * 64 for color, piece in PLANE_ORDER], dtype=np.int64)
+PIECE_SQUARE_TABLE_WEIGHTS = np.array(
+    [_PST_SCORE[color][piece] for color, piece in PLANE_ORDER], dtype=np.int64)
+
+_WHITE_BISHOP_PLANE = PLANE_ORDER.index((chess.WHITE, chess.BISHOP))
+_BLACK_BISHOP_PLANE = PLANE_ORDER.index((chess.BLACK, chess.BISHOP))
+
+def encode_boards(boards):
+    '''
+    Encode a list of boards as an (N, 12, 64) uint8 array of occupancy planes, see PLANE_ORDER.
+    '''
+    masks = np.array(
+        [[board.pieces_mask(piece, color) for color, piece in PLANE_ORDER] for board in boards],
+        dtype='<u8').reshape(len(boards), len(PLANE_ORDER))
+    # Little endian bytes and bit order put square 0 (a1) first in each plane
+    planes = np.unpackbits(masks.view(np.uint8), axis=1, bitorder='little')
+    return planes.reshape(len(boards), len(PLANE_ORDER), 64)
+
+def batch_evaluate(positions, maximising_player, material=True, pst=False):
+    '''
+    Evaluate many positions at once. positions is a list of boards or an (N, 12, 64) array
+    from encode_boards. Returns an int64 array of N scores, with the same values as
+    larry_kaufman_piece_sum if material is set, piece_square_table_eval if pst is set, or
+    their sum if both are set.
+    '''
+    planes = positions if isinstance(positions, np.ndarray) else encode_boards(positions)
+    planes = planes.reshape(-1, len(PLANE_ORDER), 64)
+
+    weights = np.zeros((len(PLANE_ORDER), 64), dtype=np.int64)
+    if material:
+        weights += MATERIAL_WEIGHTS
+    if pst:
+        weights += PIECE_SQUARE_TABLE_WEIGHTS
+    result = planes.reshape(len(planes), weights.size) @ weights.reshape(-1)
+
+    # Bishop bonus
+    if material:
+        result += BISHOP_PAIR_BONUS * (planes[:, _WHITE_BISHOP_PLANE].sum(axis=1, dtype=np.int64) == 2)
+        result -= BISHOP_PAIR_BONUS * (planes[:, _BLACK_BISHOP_PLANE].sum(axis=1, dtype=np.int64) == 2)
+
+    if maximising_player == chess.WHITE:
+        return result
+    return -result
+
+# Tapered evaluation. The middle game and end game piece square tables are blended by the
+# game phase, which goes from TOTAL_PHASE with all minor and major pieces on the board
+# down to 0 when only kings and pawns are left.
+# https://www.chessprogramming.org/Tapered_Eval
+PIECE_SQUARE_TABLE_MIDDLEGAME = PIECE_SQUARE_TABLE
+PIECE_SQUARE_TABLE_ENDGAME = {
+    **PIECE_SQUARE_TABLE,
+    # King should move to the centre once the queens and rooks are gone
+    chess.KING: (
+        -50,-30,-30,-30,-30,-30,-30,-50,
+        -30,-30,  0,  0,  0,  0,-30,-30,
+        -30,-10, 20, 30, 30, 20,-10,-30,
+        -30,-10, 30, 40, 40, 30,-10,-30,
+        -30,-10, 30, 40, 40, 30,-10,-30,
+        -30,-10, 20, 30, 30, 20,-10,-30,
+        -30,-20,-10,  0,  0,-10,-20,-30,
+        -50,-40,-30,-20,-20,-30,-40,-50,
+    ),
+}
+
+PHASE_WEIGHT = (0, 0, 1, 1, 2, 4, 0) # None, P, N, B, R, Q, K
+TOTAL_PHASE = 24
+
+def _flatten_piece_square_tables(tables):
+    # Flattened table from white's point of view, indexed by PLANE_ORDER index * 64 + square
+    flat = []
+    for color, piece in PLANE_ORDER:
+        if color == chess.WHITE:
+            flat.extend(tables[piece])
+        else:
+            flat.extend(-tables[piece][63-i] for i in range(64))
+    return tuple(flat)
+
+_TAPERED_MIDDLEGAME = _flatten_piece_square_tables(PIECE_SQUARE_TABLE_MIDDLEGAME)
+_TAPERED_ENDGAME = _flatten_piece_square_tables(PIECE_SQUARE_TABLE_ENDGAME)
+
+def game_phase(board: chess.Board):
+    '''
+    Game phase from the remaining material, TOTAL_PHASE in the opening down to 0 in a pawn ending.
+    '''
+    phase = (chess.popcount(board.knights) + chess.popcount(board.bishops)
+             + 2 * chess.popcount(board.rooks) + 4 * chess.popcount(board.queens))
+    return min(phase, TOTAL_PHASE)
+
+def tapered_eval(board: chess.Board, maximising_player):
+    '''
+    Larry Kaufman material plus a piece square table score blended between the middle game
+    and end game tables by game_phase().
+    '''
+    middlegame = 0
+    endgame = 0
+    for index, (color, piece) in enumerate(PLANE_ORDER):
+        offset = index * 64
+        for i in chess.scan_forward(board.pieces_mask(piece, color)):
+            middlegame += _TAPERED_MIDDLEGAME[offset + i]
+            endgame += _TAPERED_ENDGAME[offset + i]
+
+    phase = game_phase(board)
+    result = (middlegame * phase + endgame * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+    result += larry_kaufman_piece_sum_bitboard(board, chess.WHITE)
+
+    if maximising_player == chess.WHITE:
+        return result
+    return -result
+
+# Pawn structure. Doubled and isolated pawns are penalised and passed pawns get a bonus that
+# grows as they advance. The score only depends on where the pawns are, so it is cached in a
+# PawnHashTable keyed by a Zobrist hash of the pawns alone.
+# https://www.chessprogramming.org/Pawn_Hash_Table
+DOUBLED_PAWN_PENALTY = 10
+ISOLATED_PAWN_PENALTY = 15
+PASSED_PAWN_BONUS = (0, 5, 10, 20, 35, 60, 100, 0) # Indexed by rank, from the pawn's own side
+
+# Polyglot random numbers for pawns, indexed by [color][square]
+_PAWN_ZOBRIST = (
+    tuple(chess.polyglot.POLYGLOT_RANDOM_ARRAY[i] for i in range(64)),
+    tuple(chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 + i] for i in range(64)),
+)
+
+_ADJACENT_FILES = tuple(
+    (chess.BB_FILES[file - 1] if file > 0 else 0) | (chess.BB_FILES[file + 1] if file < 7 else 0)
+    for file in range(8))
+
+def _passed_pawn_mask(color, i):
+    # Squares in front of the pawn on its own and adjacent files
+    file = chess.square_file(i)
+    files = chess.BB_FILES[file] | _ADJACENT_FILES[file]
+    rank = chess.square_rank(i)
+    if color == chess.WHITE:
+        ranks = [chess.BB_RANKS[r] for r in range(rank + 1, 8)]
+    else:
+        ranks = [chess.BB_RANKS[r] for r in range(0, rank)]
+    mask = 0
+    for r in ranks:
+        mask |= r
+    return files & mask
+
+_PASSED_PAWN_MASK = (
+    tuple(_passed_pawn_mask(chess.BLACK, i) for i in range(64)),
+    tuple(_passed_pawn_mask(chess.WHITE, i) for i in range(64)),
+)
+
+def pawn_zobrist_hash(board: chess.Board):
+    '''
+    Polyglot Zobrist hash of the pawns only.
+    '''
+    key = 0
+    for color in chess.COLORS:
+        table = _PAWN_ZOBRIST[color]
+        for i in chess.scan_forward(board.pawns & board.occupied_co[color]):
+            key ^= table[i]
+    return key
+
+def pawn_structure_score(white_pawns, black_pawns):
+    '''
+    Doubled, isolated and passed pawn terms from white's point of view, given the pawn bitboards.
+    '''
+    result = 0
+    for color, own, enemy, sign in ((chess.WHITE, white_pawns, black_pawns, 1), (chess.BLACK, black_pawns, white_pawns, -1)):
+        for file in range(8):
+            count = chess.popcount(own & chess.BB_FILES[file])
+            if count > 1:
+                result -= sign * DOUBLED_PAWN_PENALTY * (count - 1)
+            if count and not own & _ADJACENT_FILES[file]:
+                result -= sign * ISOLATED_PAWN_PENALTY * count
+
+        passed_masks = _PASSED_PAWN_MASK[color]
+        for i in chess.scan_forward(own):
+            if not enemy & passed_masks[i]:
+                rank = chess.square_rank(i) if color == chess.WHITE else 7 - chess.square_rank(i)
+                result += sign * PASSED_PAWN_BONUS[rank]
+    return result
+
+class PawnHashTable:
+    '''
+    Fixed size cache of pawn structure scores keyed by pawn_zobrist_hash. The size is rounded up
+    to a power of two and an entry is always replaced when another pawn structure maps to its slot.
+    '''
+
+    def __init__(self, size=2**14):
+        self.size = 1 << max(size - 1, 0).bit_length()
+        self._mask = self.size - 1
+        self.keys = [None] * self.size
+        self.scores = [0] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.keys = [None] * self.size
+        self.scores = [0] * self.size
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+    def probe(self, board: chess.Board, key=None):
+        '''
+        Pawn structure score of board from white's point of view, computed on a miss.
+        key is pawn_zobrist_hash(board) if the caller keeps it up to date, otherwise it is
+        computed from the pawns.
+        '''
+        if key is None:
+            key = pawn_zobrist_hash(board)
+        index = key & self._mask
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.scores[index]
+
+        self.misses += 1
+        score = pawn_structure_score(board.pawns & board.occupied_co[chess.WHITE], board.pawns & board.occupied_co[chess.BLACK])
+        self.keys[index] = key
+        self.scores[index] = score
+        return score
+
+# Shared by pawn_structure_eval and IncrementalEvaluator unless they are given their own table
+PAWN_HASH_TABLE = PawnHashTable()
+
+def pawn_structure_eval(board: chess.Board, maximising_player, pawn_hash_table: PawnHashTable = None):
+    '''
+    Heuristic based on doubled, isolated and passed pawns, cached in pawn_hash_table.
+    '''
+    if pawn_hash_table is None:
+        pawn_hash_table = PAWN_HASH_TABLE
+    result = pawn_hash_table.probe(board)
+
+    if maximising_player == chess.WHITE:
+        return result
+    return -result
+
+class EvalCache:
+    '''
+    Wrap a heuristic with a bounded cache of its results, keyed by the Zobrist hash of the board
+    and the maximising player. When the cache is full the least recently used entry is evicted.
+    Use it directly, EvalCache(tapered_eval), or as a decorator through eval_cache(). The key is
+    read in O(1) if the search runs on a HashedBoard.
+    '''
+
+    def __init__(self, eval_func: Callable, capacity=2**16, key_func: Callable = zobrist_hash):
+        self.eval_func = eval_func
+        self.capacity = capacity
+        self.key_func = key_func
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        probes = self.hits + self.misses
+        return self.hits / probes if probes else 0.0
+
+    def __call__(self, board: chess.Board, maximising_player):
+        key = (self.key_func(board), maximising_player)
+        value = self.cache.get(key)
+        if value is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = self.eval_func(board, maximising_player)
+        self.cache[key] = value
+        if len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+        return value
+
+def eval_cache(capacity=2**16, key_func: Callable = zobrist_hash):
+    '''
+    Decorator version of EvalCache.
+
+    @eval_cache(capacity=100000)
+    def my_heuristic(board, maximising_player): ...
+    '''
+    def decorator(eval_func):
+        return EvalCache(eval_func, capacity, key_func)
+    return decorator
@@ -8,11 +8,12 @@ import time
 from math import sqrt, log
 from collections import defaultdict
 from pprint import pprint
-import chess.polyglot
-from chess.polyglot import zobrist_hash
 
 sys.path.append(os.path.dirname(__file__))
 from heuristics import *
+from hashed_board import HashedBoard, zobrist_hash
+from terminal import search_outcome
+from search_stats import SearchStats
 
 # https://gibberblot.github.io/rl-notes/single-agent/mcts.html
 # https://medium.com/@_michelangelo_/monte-carlo-tree-search-mcts-algorithm-for-dummies-74b2bae53bfa
@@ -23,7 +24,7 @@ from heuristics import *
 # qfunction is a map from (state, action) to expected rewards, or q value. We store it as a table.
 
 def hash(state, a):
-    return (chess.polyglot.zobrist_hash(state), a)
+    return (zobrist_hash(state), a)
 
 class Node():
     # Class variables
@@ -52,12 +53,16 @@ class Node():
 
         self.N = 0 # Number of times this is visited
         self.T = 0 # Total accumualated rewards
+
+        # The state never changes, so generate its moves and outcome once
+        self.legal_moves = list(state.legal_moves)
+        self.outcome = search_outcome(state, self.legal_moves)
     
 
     """ Return true if and only if all child actions have been expanded """
 
     def is_fully_expanded(self):
-        if len(list(self.state.legal_moves)) == len(self.children):
+        if len(self.legal_moves) == len(self.children):
             return True
         else:
             return False
@@ -65,7 +70,7 @@ class Node():
     """ Select a node that is not fully expanded """
 
     def select(self):
-        if not self.is_fully_expanded() or self.state.outcome():
+        if not self.is_fully_expanded() or self.outcome:
             return self
         else:
             best_actions = []
@@ -82,9 +87,9 @@ class Node():
     """ Expand a node if it is not a terminal node """
 
     def expand(self):
-        if not self.state.outcome():
+        if not self.outcome:
             visited_actions = {a[0] for a in self.children}
-            all_actions = set(self.state.legal_moves)
+            all_actions = set(self.legal_moves)
             
             # Randomly select an unexpanded action to expand
             actions = all_actions - visited_actions
@@ -95,7 +100,7 @@ class Node():
                 pprint(self.is_fully_expanded())
                 print(self.state)
                 pprint(self.children)
-                pprint(list(self.state.legal_moves))
+                pprint(self.legal_moves)
                 raise e
             
             child = self.create_new_child(action)
@@ -175,11 +180,15 @@ class MCTSAgent:
     def __init__(self, name):
         self.name = name
         self.qtable = defaultdict(lambda: 0)
+        # Print a UCI style info line after each move
+        self.verbose = False
+        # Filled in by the search, for the last move
+        self.stats = SearchStats()
 
     """The main Monte Carlo Tree Search algorithm"""
 
     def mcts(self, board, timeout=8):
-        root_node = Node(None, board, self.qtable)
+        root_node = Node(None, HashedBoard.from_board(board), self.qtable)
         current_color = board.turn
         start_time = time.time()
         current_time = time.time()
@@ -187,19 +196,25 @@ class MCTSAgent:
 
             # Find a state node to expand
             selected_node = root_node.select() # Possible for selected node to be terminal
-            if not selected_node.state.outcome():
+            if not selected_node.outcome:
 
                 child = selected_node.expand()
                 reward = self.simulate(child, current_color)
                 selected_node.back_propagate(reward, child)
+                self.stats.nodes += 1
+                self.stats.depth = max(self.stats.depth, len(child.state.move_stack) - self.stats.root_ply)
             
             current_time = time.time()
 
         return root_node.choose_best_action()
     
     def make_move(self, board):
-
-        return self.mcts(board)
+        self.stats.reset(len(board.move_stack))
+        move = self.mcts(board)
+        self.stats.stop()
+        if self.verbose:
+            print(self.stats.info_line(move=move))
+        return move
 
     """ Simulate until a terminal state """
 
@@ -207,17 +222,23 @@ class MCTSAgent:
         board = node.state.copy()
         depth = 0
 
-        while board.outcome() == None:
+        moves = list(board.legal_moves)
+        outcome = search_outcome(board, moves)
+        while outcome == None:
             # Choose an action to execute
-            move = random.choice(list(board.legal_moves))
+            move = random.choice(moves)
 
             # Execute the action
             board.push(move)
             depth += 1
+            moves = list(board.legal_moves)
+            outcome = search_outcome(board, moves)
 
-        if board.outcome().winner == None:
+        self.stats.rollouts += 1
+        self.stats.seldepth = max(self.stats.seldepth, len(board.move_stack) - self.stats.root_ply)
+        if outcome.winner == None:
             return 0
-        elif board.outcome().winner == player_color:
+        elif outcome.winner == player_color:
             return 1 # Maybe scale by depth?
         else:
             return -1
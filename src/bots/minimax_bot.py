@@ -3,48 +3,82 @@ import chess.polyglot
 import sys
 import os
 from typing import Callable
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.append(os.path.dirname(__file__))
 from heuristics import *
+from move_ordering import MoveOrderer
+from quiescence import quiescence
+from hashed_board import HashedBoard
+from terminal import is_draw
+from search_stats import SearchStats
 
 WIN_VALUE = 9999999
 DRAW_VALUE = 0
 
+def terminal_value(board: chess.Board, maximizing_player):
+    # Value of a position where the side to move has no legal moves
+    if not board.is_check():
+        return DRAW_VALUE
+    return -WIN_VALUE if board.turn == maximizing_player else WIN_VALUE
+
 class MiniMaxAgent:
 
-    def __init__(self, name, depth=2, ab_pruning=True):
+    def __init__(self, name, depth=2, ab_pruning=True, eval_func=None, move_ordering=True, use_quiescence=True,
+                 processes=1):
         self.name = name
         self.depth = depth
-        self.eval_func = larry_kaufman_piece_sum
+        # Any heuristic with the signature eval_func(board, maximising_player), e.g. tapered_eval
+        self.eval_func = eval_func if eval_func is not None else IncrementalEvaluator()
         self.ab_pruning = ab_pruning
+        self.move_ordering = move_ordering
+        self.move_orderer = MoveOrderer()
+        self.use_quiescence = use_quiescence
+        # Number of processes searching root moves in parallel, see parallel_minimax()
+        self.processes = processes
+        self._helper_pool = None
+        # Print a UCI style info line after each move
+        self.verbose = False
+        # Filled in by the search, for the last move
+        self.stats = SearchStats()
+        self.last_score = None
+
+    def close(self):
+        '''
+        Shut down the processes used by parallel_minimax().
+        '''
+        if self._helper_pool is not None:
+            self._helper_pool.shutdown()
+            self._helper_pool = None
 
     def minimax_simple(self, board, maximizing_player, depth=2):
         '''
         Naive implementation of Minimax, for testing purposes
         '''
         def _minimax(depth, board, is_maximizing_node):
+            stats.nodes += 1
 
-            outcome = board.outcome()
-            if outcome:
-                if outcome.winner == None:
-                    return None, DRAW_VALUE
-                if outcome.winner == maximizing_player:
-                    return None, WIN_VALUE
-                else:
-                    return None, -WIN_VALUE
+            if depth < root_depth and is_draw(board):
+                return None, DRAW_VALUE
 
             if(depth == 0):
+                if not any(board.generate_legal_moves()):
+                    return None, terminal_value(board, maximizing_player)
+                stats.eval_calls += 1
                 return None, self.eval_func(board, maximizing_player)
 
+            moves = list(board.legal_moves)
+            if not moves:
+                return None, terminal_value(board, maximizing_player)
+
             if(is_maximizing_node):
                 bestMoveValue = float("-inf")
                 bestMove = None
                 nextMove = None
-                for x in board.legal_moves:
-                    move = chess.Move.from_uci(str(x))
-                    board.push(move)
+                for move in moves:
+                    push(move)
                     _, current_value = _minimax(depth - 1, board, not is_maximizing_node)
-                    board.pop()
+                    pop()
                     if current_value > bestMoveValue:
                         bestMove = move
                         bestMoveValue = current_value
@@ -53,51 +87,75 @@ class MiniMaxAgent:
                 bestMoveValue = float("inf")
                 bestMove = None
                 nextMove = None
-                for x in board.legal_moves:
-                    move = chess.Move.from_uci(str(x))
-                    board.push(move)
+                for move in moves:
+                    push(move)
                     _, current_value = _minimax(depth - 1, board, not is_maximizing_node)
-                    board.pop()
+                    pop()
                     if current_value < bestMoveValue:
                         bestMove = move
                         bestMoveValue = current_value
 
                 return bestMove, bestMoveValue
 
+        board = HashedBoard.from_board(board)
+        root_depth = depth
+        stats = self.stats
+        stats.seldepth = max(stats.seldepth, depth)
+        push, pop = search_push_pop(board, self.eval_func)
         bestMove, _ = _minimax(depth, board, True)
 
         return bestMove
 
-    def minimax_alpha_beta(self, board: chess.Board, eval_func: Callable, maximizing_player, depth=2):
+    def minimax_alpha_beta(self, board: chess.Board, eval_func: Callable, maximizing_player, depth=2,
+                           alpha=float('-inf'), beta=float('inf'), root_moves=None):
+        '''
+        Minimax with alpha beta pruning. alpha and beta are the root window, and root_moves limits
+        the search to these moves of the root. The root value is stored in self.last_score.
+        '''
 
         def _minimax(depth, board: chess.Board, is_maximizing_node: bool, alpha, beta):
+            stats.nodes += 1
 
-            outcome = board.outcome()
-            if outcome:
-                if outcome.winner == None:
-                    return None, DRAW_VALUE
-                if outcome.winner == maximizing_player:
-                    return None, WIN_VALUE
-                else:
-                    return None, -WIN_VALUE
+            if depth < root_depth and is_draw(board):
+                return None, DRAW_VALUE
 
             if(depth == 0):
+                # Quiescence search finds checkmates itself. Stalemates at the horizon are not detected by it
+                if self.use_quiescence:
+                    # Quiescence search scores positions for the side to move
+                    if board.turn == maximizing_player:
+                        return None, quiescence(board, eval_func, alpha, beta, push, pop, stats=stats)
+                    return None, -quiescence(board, eval_func, -beta, -alpha, push, pop, stats=stats)
+                if not any(board.generate_legal_moves()):
+                    return None, terminal_value(board, maximizing_player)
+                stats.eval_calls += 1
                 return None, eval_func(board, maximizing_player)
 
+            ply = root_depth - depth
+            if ply == 0 and root_moves is not None:
+                moves = root_moves
+            elif self.move_ordering:
+                moves = self.move_orderer.order_moves(board, ply)
+            else:
+                moves = list(board.legal_moves)
+            if not moves:
+                return None, terminal_value(board, maximizing_player)
+
             if(is_maximizing_node):
                 bestMoveValue = float('-inf')
                 bestMove = None
-                for x in board.legal_moves:
-                    move = chess.Move.from_uci(str(x))
-                    board.push(move)
+                for move in moves:
+                    push(move)
                     _, current_value = _minimax(depth - 1, board, not is_maximizing_node, alpha, beta)
-                    board.pop()
+                    pop()
 
                     if current_value > bestMoveValue:
                         bestMove = move
                         bestMoveValue = current_value
                     
                     if bestMoveValue > beta:
+                        if self.move_ordering:
+                            self.move_orderer.record_cutoff(board, move, ply, depth)
                         return bestMove, bestMoveValue
                     alpha = max(alpha, bestMoveValue)
 
@@ -106,28 +164,103 @@ class MiniMaxAgent:
             else:
                 bestMoveValue = float('inf')
                 bestMove = None
-                for x in board.legal_moves:
-                    move = chess.Move.from_uci(str(x))
-                    board.push(move)
+                for move in moves:
+                    push(move)
                     _, current_value = _minimax(depth - 1, board, not is_maximizing_node, alpha, beta)
-                    board.pop()
+                    pop()
 
                     if current_value < bestMoveValue:
                         bestMove = move
                         bestMoveValue = current_value
 
                     if bestMoveValue < alpha:
+                        if self.move_ordering:
+                            self.move_orderer.record_cutoff(board, move, ply, depth)
                         return bestMove, bestMoveValue
                     beta = min(beta, bestMoveValue)
 
                 return bestMove, bestMoveValue
 
-        bestMove, _ = _minimax(depth, board, True, float('-inf'), float('inf'))
+        board = HashedBoard.from_board(board)
+        root_depth = depth
+        stats = self.stats
+        stats.seldepth = max(stats.seldepth, depth)
+        push, pop = search_push_pop(board, eval_func)
+        bestMove, self.last_score = _minimax(depth, board, True, alpha, beta)
 
         return bestMove
+
+    def parallel_minimax(self, board: chess.Board, eval_func: Callable, maximizing_player, depth=2):
+        '''
+        minimax_alpha_beta() split at the root over self.processes processes (young brothers wait).
+        The first root move is searched here to get a lower bound, then the other root moves are
+        searched in parallel with that bound as alpha. Plays the same move as minimax_alpha_beta(),
+        but the later root moves cannot use each other's bounds, so more nodes are searched in total.
+        '''
+        board = HashedBoard.from_board(board)
+        moves = self.move_orderer.order_moves(board) if self.move_ordering else list(board.legal_moves)
+        if depth < 2 or len(moves) < 2:
+            return self.minimax_alpha_beta(board, eval_func, maximizing_player, depth)
+
+        best_move = self.minimax_alpha_beta(board, eval_func, maximizing_player, depth, root_moves=moves[:1])
+        best_value = self.last_score
+
+        pool = self._parallel_pool()
+        root_fen = board.root().fen()
+        history = [move.uci() for move in board.move_stack]
+        futures = [pool.submit(_search_root_move, root_fen, board.chess960, history, move.uci(), depth, best_value)
+                   for move in moves[1:]]
+        # Pick the first move with the highest value, like the serial search
+        for move, future in zip(moves[1:], futures):
+            value, nodes, qnodes, eval_calls, seldepth = future.result()
+            self.stats.nodes += nodes
+            self.stats.qnodes += qnodes
+            self.stats.eval_calls += eval_calls
+            self.stats.seldepth = max(self.stats.seldepth, seldepth)
+            if value > best_value:
+                best_move, best_value = move, value
+
+        self.last_score = best_value
+        return best_move
+
+    def _parallel_pool(self):
+        if self._helper_pool is None:
+            settings = dict(depth=self.depth, eval_func=self.eval_func, move_ordering=self.move_ordering,
+                            use_quiescence=self.use_quiescence)
+            self._helper_pool = ProcessPoolExecutor(self.processes, initializer=_init_helper, initargs=(settings,))
+        return self._helper_pool
     
     def make_move(self, board: chess.Board):
-        if self.ab_pruning:
-            return self.minimax_alpha_beta(board, self.eval_func, board.turn, self.depth)
+        self.stats.reset(len(board.move_stack))
+        self.move_orderer.new_search(board)
+        if self.ab_pruning and self.processes > 1:
+            move = self.parallel_minimax(board, self.eval_func, board.turn, self.depth)
+        elif self.ab_pruning:
+            move = self.minimax_alpha_beta(board, self.eval_func, board.turn, self.depth)
         else:  
-            return self.minimax_simple(board, board.turn, self.depth)   
\ No newline at end of file
+            move = self.minimax_simple(board, board.turn, self.depth)
+        self.stats.depth = self.depth
+        self.stats.stop()
+        if self.verbose:
+            print(self.stats.info_line(move=move))
+        return move   
+
+# Processes for parallel_minimax()
+_helper = None
+
+def _init_helper(settings):
+    global _helper
+    _helper = MiniMaxAgent("helper", **settings)
+
+def _search_root_move(root_fen, chess960, history, move, depth, alpha):
+    board = HashedBoard(root_fen, chess960=chess960)
+    for past_move in history:
+        board.push_uci(past_move)
+    _helper.stats.reset(len(board.move_stack))
+    # Every root move is a separate task, only age the tables once per position
+    if _helper.move_orderer.root_ply != len(board.move_stack):
+        _helper.move_orderer.new_search(board)
+    _helper.minimax_alpha_beta(board, _helper.eval_func, board.turn, depth, alpha=alpha,
+                               root_moves=[chess.Move.from_uci(move)])
+    stats = _helper.stats
+    return _helper.last_score, stats.nodes, stats.qnodes, stats.eval_calls, stats.seldepth
@@ -0,0 +1,15 @@
+import chess
+
+# Moves packed into 16 bits: from square in bits 0-5, to square in bits 6-11 and the
+# promotion piece type in bits 12-14. 0 (a1a1) is never a legal move, so it means no move.
+NO_MOVE = 0
+
+def encode_move(move: chess.Move):
+    if not move:
+        return NO_MOVE
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def decode_move(code):
+    if code == NO_MOVE:
+        return None
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
@@ -0,0 +1,122 @@
+import chess
+import numpy as np
+from operator import itemgetter
+
+from move_encoding import NO_MOVE, encode_move
+
+# Move ordering
+# https://www.chessprogramming.org/Move_Ordering
+# Alpha beta cuts the most branches when the best move is searched first, so moves are
+# scored and sorted before the search loops over them.
+
+TT_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+PROMOTION_SCORE = 1 << 27
+KILLER_SCORE = 1 << 26
+# History scores are halved when one reaches this, so they stay below KILLER_SCORE
+HISTORY_MAX = 1 << 20
+
+class MoveOrderer:
+    '''
+    Orders the legal moves of a node: the transposition table move first, then captures by
+    MVV-LVA (most valuable victim, least valuable attacker), promotions, killer moves, and
+    finally quiet moves by their history score.
+
+    Moves are compared in their 16 bit encoding (see move_encoding), which is what the
+    transposition table and the killer slots store.
+
+    Killer moves are quiet moves that caused a beta cutoff at the same ply in a sibling node.
+    The history score of a quiet move grows by depth * depth every time it causes a cutoff.
+    Call record_cutoff() from the search so both stay up to date.
+
+    Both tables are kept between iterations of iterative deepening and between moves of the
+    same game. Call new_search() before each move to realign the killers with the new root
+    and age the history.
+    '''
+
+    def __init__(self, max_ply=64, killer_slots=2):
+        self.max_ply = max_ply
+        self.killer_slots = killer_slots
+        self.clear()
+
+    def clear(self):
+        self.killers = [[NO_MOVE] * self.killer_slots for _ in range(self.max_ply)]
+        self.history = np.zeros((2, 64, 64), dtype=np.int32) # indexed by [color][from_square][to_square]
+        self.root_ply = None
+
+    def new_search(self, board: chess.Board):
+        '''
+        Prepare for a search from board. If board is later in the same game as the last search,
+        the killers are shifted by the number of moves played since, so they stay at the same
+        distance from the start of the game. Otherwise they are cleared. History is halved so
+        older cutoffs count less.
+        '''
+        root_ply = len(board.move_stack)
+        shift = root_ply - self.root_ply if self.root_ply is not None else -1
+        if 0 < shift < self.max_ply:
+            self.killers = self.killers[shift:] + [[NO_MOVE] * self.killer_slots for _ in range(shift)]
+        elif shift != 0:
+            self.killers = [[NO_MOVE] * self.killer_slots for _ in range(self.max_ply)]
+        self.history >>= 1
+        self.root_ply = root_ply
+
+    def order_moves(self, board: chess.Board, ply=0, tt_move=NO_MOVE):
+        '''
+        Return the legal moves of board, best first. tt_move is encoded with encode_move().
+        '''
+        killers = self.killers[ply] if ply < self.max_ply else ()
+        them = board.occupied_co[not board.turn]
+        ep_square = board.ep_square
+
+        scored = []
+        quiet_moves = []
+        quiet_squares = []
+        for move in board.legal_moves:
+            from_square = move.from_square
+            to_square = move.to_square
+            code = from_square | to_square << 6 | (move.promotion or 0) << 12
+            if code == tt_move:
+                score = TT_MOVE_SCORE
+            elif chess.BB_SQUARES[to_square] & them:
+                score = CAPTURE_SCORE + 10 * board.piece_type_at(to_square) - board.piece_type_at(from_square)
+                if move.promotion:
+                    score += move.promotion
+            elif to_square == ep_square and board.is_en_passant(move):
+                score = CAPTURE_SCORE + 10 * chess.PAWN - chess.PAWN
+            elif move.promotion:
+                score = PROMOTION_SCORE + move.promotion
+            elif code in killers:
+                score = KILLER_SCORE - killers.index(code)
+            else:
+                quiet_moves.append(move)
+                quiet_squares.append(from_square * 64 + to_square)
+                continue
+            scored.append((score, move))
+
+        # Look up all quiet moves in one go
+        if quiet_moves:
+            scored += zip(self.history[int(board.turn)].take(quiet_squares).tolist(), quiet_moves)
+
+        scored.sort(key=itemgetter(0), reverse=True)
+        return [move for _, move in scored]
+
+    def record_cutoff(self, board: chess.Board, move: chess.Move, ply, depth):
+        '''
+        Update the killer moves and history after move caused a beta cutoff at ply, with depth
+        plies left to search. board is the position the move was played from. Captures and
+        promotions are already ordered first, so only quiet moves are recorded.
+        '''
+        if move.promotion or board.is_capture(move):
+            return
+
+        if ply < self.max_ply:
+            killers = self.killers[ply]
+            code = encode_move(move)
+            if killers[0] != code:
+                killers.pop()
+                killers.insert(0, code)
+
+        history = self.history[int(board.turn)]
+        history[move.from_square, move.to_square] += depth * depth
+        if history[move.from_square, move.to_square] >= HISTORY_MAX:
+            self.history >>= 1
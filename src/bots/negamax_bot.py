@@ -2,86 +2,232 @@ import chess
 import chess.polyglot
 import sys
 import os
+import time
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 from typing import Callable
-from enum import Enum
 from collections import namedtuple
 
 sys.path.append(os.path.dirname(__file__))
 from heuristics import *
+from hashed_board import HashedBoard, zobrist_hash
+from move_ordering import MoveOrderer
+from move_encoding import NO_MOVE, encode_move
+from quiescence import quiescence
+from terminal import is_draw
+from search_stats import SearchStats
+from transposition_table import TranspositionTable, SharedTranspositionTable, TTFlag, TTEntry
 
 WIN_VALUE = 9999999
 DRAW_VALUE = 0
+MAX_DEPTH = 64
 
-class NegaMaxAgent:
+# Expected number of moves left in the game, used to split the remaining clock time
+MOVES_TO_GO = 30
+
+# Half width of the window around the previous iteration's score
+ASPIRATION_WINDOW = 50
+
+# Selective search
+# https://www.chessprogramming.org/Null_Move_Pruning
+# https://www.chessprogramming.org/Late_Move_Reductions
+# https://www.chessprogramming.org/Futility_Pruning
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+# Quiet moves after the first LMR_MIN_MOVES moves are searched LMR_REDUCTION plies shallower first
+LMR_MIN_MOVES = 3
+LMR_MIN_DEPTH = 3
+LMR_REDUCTION = 1
+# Margin by depth left, quiet moves are skipped if the static evaluation plus the margin cannot raise alpha
+FUTILITY_MARGIN = (0, 200, 500)
+
+# Result of one iterative deepening iteration
+IterationInfo = namedtuple("IterationInfo", ['depth', 'score', 'nodes', 'time', 'move'])
 
-    # Transposition table is key-value dirciontary. 
-    # Key is state of board, value is tuple (flag, value, depth, move)
-    class TTFlag(Enum):
-        EXACT = 1
-        UPPERBOUND = 2
-        LOWERBOUND = 3
+class SearchTimeout(Exception):
+    pass
 
-    TTEntry = namedtuple("TTEntry", ['flag', 'value', 'depth', 'move'])
+class NegaMaxAgent:
+
+    # Transposition table is a fixed size table keyed by Zobrist hash.
+    # Each entry is a tuple (flag, value, depth, move), with the move encoded in 16 bits
+    TTFlag = TTFlag
+    TTEntry = TTEntry
 
-    def __init__(self, name, depth=2, use_transposition_table=True):
+    def __init__(self, name, depth=2, use_transposition_table=True, eval_func=None, move_ordering=True, movetime=None,
+                 tt_size_mb=16, use_quiescence=True, selective_search=True, processes=1):
         self.name = name
         self.depth = depth
-        self.eval_func = larry_kaufman_piece_sum
+        # Seconds per move. If set, make_move searches with iterative deepening instead of to a fixed depth
+        self.movetime = movetime
+        # Any heuristic with the signature eval_func(board, maximising_player), e.g. tapered_eval
+        self.eval_func = eval_func if eval_func is not None else IncrementalEvaluator()
         self.use_transposition_table = use_transposition_table
+        self.move_ordering = move_ordering
+        self.move_orderer = MoveOrderer()
+        self.use_quiescence = use_quiescence
+        # Null move pruning, late move reductions and futility pruning in negamax_transposition_table
+        self.selective_search = selective_search
+        # Number of processes searching in parallel with Lazy SMP, see lazy_smp()
+        self.processes = processes
+        self.tt_size_mb = tt_size_mb
+        # Replaced by a SharedTranspositionTable when the Lazy SMP helpers are started
+        self.transposition_table = TranspositionTable(tt_size_mb)
+        # Shared flag that aborts the search when set, used to stop the Lazy SMP helpers
+        self.stop_flag = None
+        self._helper_pool = None
+        # Frees the helpers and the shared table on close(), or when the agent is garbage collected
+        self._finalizer = None
+        # Print a UCI style info line per iteration of iterative deepening
+        self.verbose = False
 
-    transposition_table = {}
+        # Filled in by the search, for the last move
+        self.stats = SearchStats()
+        self.last_score = None
+        self.iterations = []
 
     def reset_transposition_table(self):
-        self.transposition_table = {}
+        self.transposition_table.clear()
 
-    def negamax_transposition_table(self, board: chess.Board, eval_func: Callable, player_color, depth=2):
+    def close(self):
         '''
-        Run Negamax algorithm
+        Shut down the Lazy SMP helper processes and free the shared transposition table.
+        The agent can still be used afterwards, and starts them again when it needs them.
         '''
-        def _negamax(depth, board: chess.Board, color, alpha, beta):
-            
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+            self._helper_pool = None
+            self.transposition_table = TranspositionTable(self.tt_size_mb)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def negamax_transposition_table(self, board: chess.Board, eval_func: Callable, player_color, depth=2, deadline=None,
+                                    alpha=float('-inf'), beta=float('inf')):
+        '''
+        Run Negamax algorithm with principal variation search. The first (best ordered) move of
+        each node is searched with the full window and the rest with a null window, only
+        re-searching a move with the full window if it turns out to be better.
+
+        deadline: float - time.time() at which to abort the search by raising SearchTimeout.
+        The board is restored before the exception propagates.
+        alpha, beta: the root window. The root score is stored in self.last_score.
+
+        With selective_search, nodes outside the principal variation also try null move pruning
+        (not in pawn endings, where zugzwang is common), late move reductions for quiet moves
+        and futility pruning of quiet moves in the last FUTILITY_MARGIN plies.
+        '''
+        def _negamax(depth, board: chess.Board, color, alpha, beta, allow_null=True):
+            if deadline is not None and time.time() >= deadline:
+                raise SearchTimeout()
+            if stop_flag is not None and stop_flag.value:
+                raise SearchTimeout()
+            stats.nodes += 1
+
+            ply = len(board.move_stack) - root_ply
+            if ply > stats.seldepth:
+                stats.seldepth = ply
+            # Repetitions depend on the path, check them before the transposition table
+            if ply > 0 and is_draw(board):
+                return None, DRAW_VALUE
+
             alpha_orignal = alpha
 
-            tt_key = chess.polyglot.zobrist_hash(board)
-            if tt_key in self.transposition_table and self.transposition_table[tt_key].depth >= depth:
-                ttentry = self.transposition_table[tt_key]
+            tt_key = zobrist_hash(board)
+            ttentry = self.transposition_table.probe(tt_key)
+            stats.tt_probes += 1
+            if ttentry is not None:
+                stats.tt_hits += 1
+            # Never end the root early, its move must come from this search
+            if ttentry is not None and ttentry.depth >= depth and ply > 0:
                 if ttentry.flag == NegaMaxAgent.TTFlag.EXACT:
-                    return ttentry.move, ttentry.value
+                    stats.tt_cutoffs += 1
+                    return None, ttentry.value
                 elif ttentry.flag == NegaMaxAgent.TTFlag.LOWERBOUND:
                     alpha = max(alpha, ttentry.value)
                 elif ttentry.flag == NegaMaxAgent.TTFlag.UPPERBOUND:
                     beta = min(beta, ttentry.value)         
                 if alpha >= beta:
-                    return ttentry.move, ttentry.value
-
-            outcome = board.outcome()
-            if outcome:
-                if outcome.winner == None:
-                    return None, DRAW_VALUE
-                if outcome.winner == chess.WHITE:
-                    return None, color * WIN_VALUE
-                else:
-                    return None, -WIN_VALUE * color
+                    stats.tt_cutoffs += 1
+                    return None, ttentry.value
 
+            in_check = board.is_check()
             if(depth == 0):
+                # Quiescence search finds checkmates itself. Stalemates at the horizon are not detected by it
+                if self.use_quiescence:
+                    return None, quiescence(board, eval_func, alpha, beta, push, pop, stats=stats)
+                if not any(board.generate_legal_moves()):
+                    return None, -WIN_VALUE if in_check else DRAW_VALUE
+                stats.eval_calls += 1
                 return None, color * eval_func(board, chess.WHITE)
 
+            # Only prune in nodes searched with a null window, not on the principal variation
+            selective = self.selective_search and not in_check and ply > 0 and beta - alpha <= 1
+            futile = False
+            if selective:
+                static_eval = color * eval_func(board, chess.WHITE)
+                stats.eval_calls += 1
+
+                # If passing still fails high, a real move will too. Not with only pawns left, where
+                # every move can make the position worse
+                if (allow_null and depth >= NULL_MOVE_MIN_DEPTH and static_eval >= beta
+                        and board.occupied_co[board.turn] & ~(board.pawns | board.kings)):
+                    push(chess.Move.null())
+                    _, null_value = _negamax(max(depth - 1 - NULL_MOVE_REDUCTION, 0), board, -color, -beta, -beta + 1, False)
+                    null_value = -null_value
+                    pop()
+                    # Do not trust mate scores found after passing
+                    if null_value >= beta and abs(null_value) < WIN_VALUE:
+                        return None, null_value
+
+                futile = depth < len(FUTILITY_MARGIN) and static_eval + FUTILITY_MARGIN[depth] <= alpha
+
+            if self.move_ordering:
+                moves = self.move_orderer.order_moves(board, ply, ttentry.move if ttentry is not None else NO_MOVE)
+            else:
+                moves = list(board.legal_moves)
+            if not moves:
+                return None, -WIN_VALUE if in_check else DRAW_VALUE
+
             bestMoveValue = float('-inf')
             bestMove = None
-            for x in board.legal_moves:
-
-                move = chess.Move.from_uci(str(x))
-                board.push(move)
-                _, current_value = _negamax(depth - 1, board, -color, -beta, -alpha)
-                current_value = -current_value
-                board.pop()
+            for move_number, move in enumerate(moves):
+                quiet = selective and not move.promotion and not board.is_capture(move)
+                push(move)
+                quiet = quiet and not board.is_check()
+                if bestMove is None:
+                    _, current_value = _negamax(depth - 1, board, -color, -beta, -alpha)
+                    current_value = -current_value
+                elif quiet and futile:
+                    pop()
+                    continue
+                else:
+                    current_value = float('inf')
+                    if quiet and move_number >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH:
+                        _, current_value = _negamax(depth - 1 - LMR_REDUCTION, board, -color, -alpha - 1, -alpha)
+                        current_value = -current_value
+                    # Search at full depth unless the reduced search failed low
+                    if current_value > alpha:
+                        _, current_value = _negamax(depth - 1, board, -color, -alpha - 1, -alpha)
+                        current_value = -current_value
+                    if alpha < current_value < beta:
+                        _, current_value = _negamax(depth - 1, board, -color, -beta, -alpha)
+                        current_value = -current_value
+                pop()
 
                 if current_value > bestMoveValue:
                     bestMove = move
                     bestMoveValue = current_value
                 
-                if bestMoveValue > beta:
-                    return bestMove, bestMoveValue
+                if bestMoveValue >= beta:
+                    if self.move_ordering:
+                        self.move_orderer.record_cutoff(board, move, ply, depth)
+                    break
                 alpha = max(alpha, bestMoveValue)
 
             newflag = NegaMaxAgent.TTFlag.EXACT
@@ -89,58 +235,249 @@ class NegaMaxAgent:
                 newflag = NegaMaxAgent.TTFlag.UPPERBOUND
             elif bestMoveValue >= beta:
                 newflag = NegaMaxAgent.TTFlag.LOWERBOUND
-            new_tt_entry = NegaMaxAgent.TTEntry(value=bestMoveValue, move=bestMove, depth=depth, flag=newflag)
-
-            self.transposition_table[tt_key] = new_tt_entry
+            self.transposition_table.store(tt_key, newflag, bestMoveValue, depth, encode_move(bestMove))
 
             return bestMove, bestMoveValue
 
+        # Keeps the Zobrist hash up to date on push and pop instead of rehashing every node
+        board = HashedBoard.from_board(board)
         color = 1 if player_color == chess.WHITE else -1
-        bestMove, _ = _negamax(depth, board, color, float('-inf'), float('inf'))
+        root_ply = len(board.move_stack)
+        stats = self.stats
+        stop_flag = self.stop_flag
+        push, pop = search_push_pop(board, eval_func)
+        try:
+            bestMove, self.last_score = _negamax(depth, board, color, alpha, beta)
+        except SearchTimeout:
+            while len(board.move_stack) > root_ply:
+                pop()
+            raise
 
         return bestMove
     
-    def negamax(self, board: chess.Board, eval_func: Callable, player_color, depth=2):
+    def negamax(self, board: chess.Board, eval_func: Callable, player_color, depth=2, deadline=None):
+        '''
+        Run Negamax algorithm with alpha-beta pruning and no transposition table.
+
+        deadline: float - time.time() at which to abort the search by raising SearchTimeout.
+        The board is restored before the exception propagates.
+        '''
         def _negamax(depth, board: chess.Board, color, alpha, beta):
-            outcome = board.outcome()
-            if outcome:
-                if outcome.winner == None:
-                    return None, DRAW_VALUE
-                if outcome.winner == chess.WHITE:
-                    return None, color * WIN_VALUE
-                else:
-                    return None, -WIN_VALUE * color
+            if deadline is not None and time.time() >= deadline:
+                raise SearchTimeout()
+            stats.nodes += 1
+            if depth < root_depth and is_draw(board):
+                return None, DRAW_VALUE
 
             if(depth == 0):
+                if self.use_quiescence:
+                    return None, quiescence(board, eval_func, alpha, beta, push, pop, stats=stats)
+                if not any(board.generate_legal_moves()):
+                    return None, -WIN_VALUE if board.is_check() else DRAW_VALUE
+                stats.eval_calls += 1
                 return None, color * eval_func(board, chess.WHITE)
 
+            ply = root_depth - depth
+            if self.move_ordering:
+                moves = self.move_orderer.order_moves(board, ply)
+            else:
+                moves = list(board.legal_moves)
+            if not moves:
+                return None, -WIN_VALUE if board.is_check() else DRAW_VALUE
+
             bestMoveValue = float('-inf')
             bestMove = None
-            for x in board.legal_moves:
-
-                move = chess.Move.from_uci(str(x))
-                board.push(move)
+            for move in moves:
+                push(move)
                 _, current_value = _negamax(depth - 1, board, -color, -beta, -alpha)
                 current_value = -current_value
-                board.pop()
+                pop()
 
                 if current_value > bestMoveValue:
                     bestMove = move
                     bestMoveValue = current_value
                 
                 if bestMoveValue > beta:
+                    if self.move_ordering:
+                        self.move_orderer.record_cutoff(board, move, ply, depth)
                     return bestMove, bestMoveValue
                 alpha = max(alpha, bestMoveValue)
 
             return bestMove, bestMoveValue
 
+        board = HashedBoard.from_board(board)
         color = 1 if player_color == chess.WHITE else -1
-        bestMove, _ = _negamax(depth, board, color, float('-inf'), float('inf'))
+        root_depth = depth
+        root_ply = len(board.move_stack)
+        stats = self.stats
+        stats.seldepth = max(stats.seldepth, depth)
+        push, pop = search_push_pop(board, eval_func)
+        try:
+            bestMove, self.last_score = _negamax(depth, board, color, float('-inf'), float('inf'))
+        except SearchTimeout:
+            while len(board.move_stack) > root_ply:
+                pop()
+            raise
 
         return bestMove
 
-    def make_move(self, board: chess.Board):
-        if self.use_transposition_table:
-            return self.negamax_transposition_table(board, self.eval_func, board.turn, self.depth)
+    def iterative_deepening(self, board: chess.Board, eval_func: Callable, player_color, time_limit=None, max_depth=MAX_DEPTH,
+                            start_depth=1):
+        '''
+        Search depth 1, 2, ... until time_limit seconds have passed (or max_depth is done) and return
+        the best move of the last completed iteration. The transposition table is kept between
+        iterations, so each iteration searches the previous best moves first.
+
+        From depth 2 on, the search starts with an aspiration window of ASPIRATION_WINDOW around the
+        previous score, and opens the side that failed if the score falls outside it. Each completed
+        iteration is recorded in self.iterations, and in self.stats.
+
+        Without use_transposition_table, each iteration is a plain negamax search with the full window.
+        Returns None if there are no legal moves.
+        '''
+        start = time.time()
+        deadline = start + time_limit if time_limit is not None else None
+        board = HashedBoard.from_board(board)
+        self.iterations = []
+
+        best_move = None
+        score = None
+        for depth in range(start_depth, max_depth + 1):
+            alpha, beta = float('-inf'), float('inf')
+            if score is not None:
+                alpha, beta = score - ASPIRATION_WINDOW, score + ASPIRATION_WINDOW
+            try:
+                if not self.use_transposition_table:
+                    move = self.negamax(board, eval_func, player_color, depth, deadline)
+                else:
+                    while True:
+                        move = self.negamax_transposition_table(board, eval_func, player_color, depth, deadline,
+                                                                alpha, beta)
+                        if self.last_score <= alpha:
+                            alpha = float('-inf')
+                        elif self.last_score >= beta:
+                            beta = float('inf')
+                        else:
+                            break
+            except SearchTimeout:
+                break
+
+            best_move = move
+            score = self.last_score
+            self.stats.depth = depth
+            self.iterations.append(IterationInfo(depth, score, self.stats.nodes, time.time() - start, best_move))
+            if self.verbose:
+                print(self.stats.info_line(score, best_move))
+
+            # The next iteration takes several times longer, do not start it if it cannot finish
+            if time_limit is not None and time.time() - start > time_limit / 2:
+                break
+
+        # An aborted iteration can leave the score of a partial search behind
+        self.last_score = score
+        if best_move is None:
+            best_move = next(iter(board.legal_moves), None)
+        return best_move
+
+    def lazy_smp(self, board: chess.Board, time_limit=None, max_depth=MAX_DEPTH):
+        '''
+        Search with self.processes processes sharing one transposition table (Lazy SMP). This process
+        runs the usual iterative deepening while processes - 1 helpers search the same position, every
+        other one starting a ply deeper so they fill the table ahead of it. The helpers stop when this
+        process finishes, and the move of the deepest completed iteration is played.
+        '''
+        pool = self._lazy_smp_pool()
+        self.stop_flag.value = 0
+        root_fen = board.root().fen()
+        moves = [move.uci() for move in board.move_stack]
+        futures = [pool.submit(_helper_search, root_fen, board.chess960, moves, self.transposition_table.age,
+                               time_limit, max_depth, 1 + i % 2)
+                   for i in range(1, self.processes)]
+
+        best_move = self.iterative_deepening(board, self.eval_func, board.turn, time_limit, max_depth)
+        best_depth = self.stats.depth
+        self.stop_flag.value = 1
+
+        for future in futures:
+            depth, score, move, nodes, qnodes = future.result()
+            self.stats.nodes += nodes
+            self.stats.qnodes += qnodes
+            if depth > best_depth:
+                best_depth, best_move, self.last_score = depth, move and chess.Move.from_uci(move), score
+        self.stats.depth = best_depth
+        return best_move
+
+    def _lazy_smp_pool(self):
+        if self._helper_pool is None:
+            shared_table = SharedTranspositionTable(self.tt_size_mb)
+            shared_table.age = self.transposition_table.age
+            self.transposition_table = shared_table
+            self.stop_flag = multiprocessing.RawValue('b', 0)
+            settings = dict(depth=self.depth, eval_func=self.eval_func, move_ordering=self.move_ordering,
+                            use_quiescence=self.use_quiescence, selective_search=self.selective_search)
+            self._helper_pool = ProcessPoolExecutor(
+                self.processes - 1, initializer=_init_helper,
+                initargs=(settings, self.transposition_table.name, self.tt_size_mb, self.stop_flag))
+            self._finalizer = weakref.finalize(self, _shut_down_helpers, self._helper_pool, shared_table)
+        return self._helper_pool
+
+    def time_for_move(self, board: chess.Board, movetime=None, wtime=None, btime=None, winc=0, binc=0):
+        '''
+        Seconds to spend on this move, or None to search to a fixed depth. Takes a fixed movetime,
+        or the clock of the side to move (wtime/btime) plus its increment (winc/binc), all in seconds.
+        '''
+        if movetime is None and wtime is None and btime is None:
+            movetime = self.movetime
+        if movetime is not None:
+            return movetime
+
+        remaining, increment = (wtime, winc) if board.turn == chess.WHITE else (btime, binc)
+        if remaining is None:
+            return None
+        # Never use more than half of the remaining time on one move
+        return min(remaining / MOVES_TO_GO + increment * 0.75, remaining / 2)
+
+    def make_move(self, board: chess.Board, movetime=None, wtime=None, btime=None, winc=0, binc=0):
+        self.stats.reset(len(board.move_stack))
+        self.transposition_table.new_search()
+        self.move_orderer.new_search(board)
+        time_limit = self.time_for_move(board, movetime, wtime, btime, winc, binc)
+        if self.processes > 1 and self.use_transposition_table:
+            move = self.lazy_smp(board, time_limit, MAX_DEPTH if time_limit is not None else self.depth)
+        elif time_limit is not None:
+            move = self.iterative_deepening(board, self.eval_func, board.turn, time_limit)
+        elif self.use_transposition_table:
+            move = self.iterative_deepening(board, self.eval_func, board.turn, max_depth=self.depth)
         else:
-            return self.negamax(board, self.eval_func, board.turn, self.depth)   
\ No newline at end of file
+            move = self.negamax(board, self.eval_func, board.turn, self.depth)
+            self.stats.depth = self.depth
+            if self.verbose:
+                print(self.stats.info_line(self.last_score, move))
+        self.stats.stop()
+        return move   
+# Lazy SMP helper processes
+# https://www.chessprogramming.org/Lazy_SMP
+_helper = None
+
+def _shut_down_helpers(pool, shared_table):
+    # Must not refer to the agent, or weakref.finalize would keep it alive
+    pool.shutdown()
+    shared_table.close()
+    shared_table.unlink()
+
+def _init_helper(settings, tt_name, tt_size_mb, stop_flag):
+    global _helper
+    _helper = NegaMaxAgent("helper", **settings)
+    _helper.transposition_table = SharedTranspositionTable(tt_size_mb, tt_name)
+    _helper.stop_flag = stop_flag
+
+def _helper_search(root_fen, chess960, moves, age, time_limit, max_depth, start_depth):
+    board = HashedBoard(root_fen, chess960=chess960)
+    for move in moves:
+        board.push_uci(move)
+    _helper.transposition_table.age = age
+    _helper.stats.reset(len(board.move_stack))
+    _helper.move_orderer.new_search(board)
+    move = _helper.iterative_deepening(board, _helper.eval_func, board.turn, time_limit, max_depth, start_depth)
+    stats = _helper.stats
+    return stats.depth, _helper.last_score, move and move.uci(), stats.nodes, stats.qnodes
@@ -0,0 +1,94 @@
+import chess
+from typing import Callable
+from operator import itemgetter
+
+from see import see, SEE_PIECE_VALUE
+
+# Quiescence search
+# https://www.chessprogramming.org/Quiescence_Search
+# At the horizon the position can be in the middle of a capture sequence, so instead of
+# returning the static evaluation, keep searching captures and promotions until it is quiet.
+
+WIN_VALUE = 9999999
+
+# Skip a capture if even winning the captured piece plus this margin cannot raise alpha
+DELTA_MARGIN = 200
+# Plies of captures to search before falling back to the static evaluation
+MAX_QUIESCENCE_DEPTH = 8
+
+def _noisy_moves(board: chess.Board):
+    # Captures and promotions ordered by MVV-LVA
+    promotion_rank = chess.BB_RANK_7 if board.turn == chess.WHITE else chess.BB_RANK_2
+    moves = list(board.generate_legal_captures())
+    moves += [move for move in board.generate_legal_moves(from_mask=board.pawns & promotion_rank)
+              if move.promotion and not board.is_capture(move)]
+
+    scored = []
+    for move in moves:
+        victim = board.piece_type_at(move.to_square) or chess.PAWN
+        scored.append((10 * victim - board.piece_type_at(move.from_square) + (move.promotion or 0), move))
+    scored.sort(key=itemgetter(0), reverse=True)
+    return [move for _, move in scored]
+
+def quiescence(board: chess.Board, eval_func: Callable, alpha, beta, push=None, pop=None, depth=MAX_QUIESCENCE_DEPTH,
+               stats=None):
+    '''
+    Negamax search over captures and promotions only. Returns the score for the side to move.
+
+    The side to move can always "stand pat" and keep the static evaluation instead of capturing,
+    unless it is in check, in which case all evasions are searched. Captures that lose material
+    by static exchange evaluation, or that cannot raise alpha even with DELTA_MARGIN to spare
+    (delta pruning), are skipped.
+
+    push and pop default to board.push and board.pop, see search_push_pop().
+    stats: SearchStats to count qnodes, eval_calls and seldepth in.
+    '''
+    push = push or board.push
+    pop = pop or board.pop
+
+    def _quiescence(alpha, beta, depth):
+        if stats is not None:
+            stats.qnodes += 1
+            stats.seldepth = max(stats.seldepth, len(board.move_stack) - stats.root_ply)
+        in_check = board.is_check()
+        if in_check:
+            moves = list(board.legal_moves)
+            if not moves:
+                return -WIN_VALUE
+            stand_pat = float('-inf')
+        else:
+            stand_pat = eval_func(board, board.turn)
+            if stats is not None:
+                stats.eval_calls += 1
+            if stand_pat >= beta or depth <= 0:
+                return stand_pat
+            alpha = max(alpha, stand_pat)
+            moves = _noisy_moves(board)
+
+        best_value = stand_pat
+        for move in moves:
+            if not in_check:
+                if not move.promotion:
+                    captured = board.piece_type_at(move.to_square) or chess.PAWN # Empty square means en passant
+                    optimistic = stand_pat + SEE_PIECE_VALUE[captured] + DELTA_MARGIN
+                    if optimistic < alpha:
+                        # The skipped capture could score up to optimistic, so the returned
+                        # upper bound must not claim less
+                        best_value = max(best_value, optimistic)
+                        continue
+                if see(board, move) < 0:
+                    continue
+
+            push(move)
+            value = -_quiescence(-beta, -alpha, depth - 1)
+            pop()
+
+            if value > best_value:
+                best_value = value
+            if best_value >= beta:
+                return best_value
+            alpha = max(alpha, best_value)
+
+        return best_value
+
+    return _quiescence(alpha, beta, depth)
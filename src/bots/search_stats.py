@@ -0,0 +1,72 @@
+import time
+
+class SearchStats:
+    '''
+    Counters for the last make_move() of a bot, reset at the start of every move.
+
+    nodes: positions searched by the main search (tree nodes for MCTS)
+    qnodes: positions searched by quiescence search
+    depth: last completed search depth (deepest tree node for MCTS)
+    seldepth: deepest ply reached, including quiescence search (or rollouts for MCTS)
+    tt_probes, tt_hits, tt_cutoffs: transposition table lookups, lookups that found the
+        position and lookups that ended the node without searching it
+    eval_calls: calls to the evaluation function
+    rollouts: MCTS simulations
+    time: seconds spent, set by stop()
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, root_ply=0):
+        # Length of the move stack at the root, to turn the move stack into a ply
+        self.root_ply = root_ply
+        self.start_time = time.time()
+        self.time = 0.0
+        self.nodes = 0
+        self.qnodes = 0
+        self.depth = 0
+        self.seldepth = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.eval_calls = 0
+        self.rollouts = 0
+
+    def stop(self):
+        self.time = time.time() - self.start_time
+
+    def elapsed(self):
+        return self.time if self.time else time.time() - self.start_time
+
+    @property
+    def nps(self):
+        elapsed = self.elapsed()
+        return int((self.nodes + self.qnodes) / elapsed) if elapsed > 0 else 0
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def info_line(self, score=None, move=None):
+        '''
+        UCI style info line. Counters without a UCI field go after "string".
+        score is in centipawns for the side to move.
+        '''
+        line = f"info depth {self.depth} seldepth {self.seldepth}"
+        if score is not None:
+            line += f" score cp {int(score)}"
+        line += f" nodes {self.nodes + self.qnodes} nps {self.nps} time {int(self.elapsed() * 1000)}"
+        if move is not None:
+            line += f" pv {move.uci()}"
+        line += f" string qnodes {self.qnodes} ttprobes {self.tt_probes} tthits {self.tt_hits}"
+        line += f" ttcutoffs {self.tt_cutoffs} evals {self.eval_calls}"
+        if self.rollouts:
+            line += f" rollouts {self.rollouts}"
+        return line
+
+    def __repr__(self):
+        return (f"SearchStats(nodes={self.nodes}, qnodes={self.qnodes}, nps={self.nps}, depth={self.depth}, "
+                f"seldepth={self.seldepth}, tt_probes={self.tt_probes}, tt_hits={self.tt_hits}, "
+                f"tt_cutoffs={self.tt_cutoffs}, eval_calls={self.eval_calls}, rollouts={self.rollouts}, "
+                f"time={self.elapsed():.3f})")
@@ -0,0 +1,64 @@
+import chess
+
+# Static exchange evaluation
+# https://www.chessprogramming.org/Static_Exchange_Evaluation
+
+# Larry Kaufman piece values, the king is worth more than everything else combined
+SEE_PIECE_VALUE = (0, 100, 325, 325, 500, 975, 20000) # None, P, N, B, R, Q, K
+
+def _least_valuable_attacker(board: chess.Board, attackers):
+    for piece, mask in ((chess.PAWN, board.pawns), (chess.KNIGHT, board.knights), (chess.BISHOP, board.bishops),
+                        (chess.ROOK, board.rooks), (chess.QUEEN, board.queens), (chess.KING, board.kings)):
+        if attackers & mask:
+            return piece, attackers & mask & -(attackers & mask)
+    return None, 0
+
+def see(board: chess.Board, move: chess.Move):
+    '''
+    Material won by the side to move if move starts a capture sequence on its target square
+    and both sides keep recapturing with their least valuable piece, stopping whenever that
+    would lose material. Works without making any moves, using board.attackers_mask() with
+    captured pieces removed from the occupancy so X-ray attackers join in.
+
+    A positive value means the move wins material, 0 an even trade (or a safe quiet move) and
+    a negative value that it loses material. Pins are ignored.
+    '''
+    from_square = move.from_square
+    to_square = move.to_square
+    occupied = board.occupied ^ chess.BB_SQUARES[from_square]
+
+    piece = board.piece_type_at(from_square)
+    if piece == chess.PAWN and to_square == board.ep_square and board.is_en_passant(move):
+        occupied ^= chess.BB_SQUARES[to_square - 8 if board.turn == chess.WHITE else to_square + 8]
+        captured_value = SEE_PIECE_VALUE[chess.PAWN]
+    else:
+        captured_value = SEE_PIECE_VALUE[board.piece_type_at(to_square) or 0]
+
+    if move.promotion:
+        captured_value += SEE_PIECE_VALUE[move.promotion] - SEE_PIECE_VALUE[chess.PAWN]
+        piece = move.promotion
+
+    # gain[i] is the material balance for the side making the i-th capture, if it stops there
+    gain = [captured_value]
+    piece_on_square = piece
+    color = not board.turn
+    while True:
+        attackers = board.attackers_mask(color, to_square, occupied) & occupied
+        if not attackers:
+            break
+        piece, attacker_bb = _least_valuable_attacker(board, attackers)
+        gain.append(SEE_PIECE_VALUE[piece_on_square] - gain[-1])
+        piece_on_square = piece
+        occupied ^= attacker_bb
+        color = not color
+
+        # The king can only recapture if the square is no longer defended
+        if piece == chess.KING and board.attackers_mask(color, to_square, occupied) & occupied:
+            gain.pop()
+            break
+
+    # Either side can stop recapturing when continuing would lose material
+    while len(gain) > 1:
+        last = gain.pop()
+        gain[-1] = -max(-gain[-1], last)
+    return gain[0]
@@ -0,0 +1,42 @@
+import chess
+
+from hashed_board import HashedBoard
+
+# Terminal checks for the search
+# board.outcome() generates the legal moves to look for checkmate and stalemate, and replays the
+# move stack to look for repetitions. A search node generates its moves anyway, so these checks
+# take the move list instead, and find repetitions from the hash history of a HashedBoard.
+# Draws that can only be claimed (threefold repetition, fifty moves) are not checked.
+
+def is_repetition(board: chess.Board, count=2):
+    '''
+    True if the position occurred count times, including this one, since the last capture or pawn move.
+    '''
+    if isinstance(board, HashedBoard):
+        return board.is_repetition_fast(count)
+    return board.is_repetition(count)
+
+def is_draw(board: chess.Board, repetitions=2):
+    '''
+    Draw by insufficient material, the seventy-five-move rule or repetition, without generating moves.
+    The search default counts a single repetition as a draw, since the side that repeats could
+    repeat again.
+    '''
+    return board.halfmove_clock >= 150 or board.is_insufficient_material() or is_repetition(board, repetitions)
+
+def search_outcome(board: chess.Board, moves, repetitions=5):
+    '''
+    Same as board.outcome() (which draws on fivefold repetition), given the legal moves of board.
+    '''
+    if not moves:
+        if board.is_check():
+            return chess.Outcome(chess.Termination.CHECKMATE, not board.turn)
+        return chess.Outcome(chess.Termination.STALEMATE, None)
+    if board.is_insufficient_material():
+        return chess.Outcome(chess.Termination.INSUFFICIENT_MATERIAL, None)
+    if board.halfmove_clock >= 150:
+        return chess.Outcome(chess.Termination.SEVENTYFIVE_MOVES, None)
+    if is_repetition(board, repetitions):
+        termination = chess.Termination.FIVEFOLD_REPETITION if repetitions >= 5 else chess.Termination.THREEFOLD_REPETITION
+        return chess.Outcome(termination, None)
+    return None
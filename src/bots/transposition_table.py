@@ -0,0 +1,167 @@
+import numpy as np
+from enum import IntEnum
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+from move_encoding import NO_MOVE
+
+# Transposition table
+# https://www.chessprogramming.org/Transposition_Table
+
+class TTFlag(IntEnum):
+    EXACT = 1
+    UPPERBOUND = 2
+    LOWERBOUND = 3
+
+# move is encoded with move_encoding.encode_move()
+TTEntry = namedtuple("TTEntry", ['flag', 'value', 'depth', 'move'])
+
+# Bytes per entry: key, value, depth, flag, move, age
+ENTRY_SIZE = 8 + 4 + 1 + 1 + 2 + 1
+
+def _bucket_count(size_mb):
+    buckets = max(1, (size_mb * 1024 * 1024) // (2 * ENTRY_SIZE))
+    return 1 << (buckets.bit_length() - 1) # Round down to a power of two
+
+class TranspositionTable:
+    '''
+    Fixed size transposition table stored in NumPy columns (key, value, depth, flag, move, age),
+    so memory stays flat no matter how long it is used.
+
+    The table has a power of two number of buckets indexed by the low bits of the Zobrist key.
+    Each bucket has two slots. The first keeps the deepest entry and is only replaced by a search
+    that is at least as deep, or if its entry is from an earlier search (older age). The second
+    slot is always replaced. The full key is stored to detect index collisions.
+    '''
+
+    def __init__(self, size_mb=16, buffer=None):
+        '''
+        buffer: memory to keep the columns in, at least size() bytes. Zeroed memory is allocated if not given.
+        '''
+        self.buckets = _bucket_count(size_mb)
+        self._mask = self.buckets - 1
+        slots = 2 * self.buckets
+        if buffer is None:
+            buffer = np.zeros(slots * ENTRY_SIZE, dtype=np.uint8)
+        columns = []
+        offset = 0
+        for dtype in (np.uint64, np.int32, np.uint16, np.uint8, np.uint8, np.uint8):
+            columns.append(np.ndarray(slots, dtype=dtype, buffer=buffer, offset=offset))
+            offset += slots * np.dtype(dtype).itemsize
+        # A flag of 0 means the slot is empty
+        self.keys, self.values, self.moves, self.depths, self.flags, self.ages = columns
+        self.age = 0
+
+    @staticmethod
+    def size(size_mb):
+        '''
+        Bytes used by a table of size_mb megabytes, after rounding down to a power of two buckets.
+        '''
+        return 2 * _bucket_count(size_mb) * ENTRY_SIZE
+
+    def clear(self):
+        for column in (self.keys, self.values, self.depths, self.flags, self.moves, self.ages):
+            column.fill(0)
+        self.age = 0
+
+    def new_search(self):
+        '''
+        Call before searching a new position, so entries from earlier searches are replaced first.
+        '''
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key):
+        '''
+        Return the TTEntry stored for key, or None.
+        '''
+        index = (key & self._mask) << 1
+        for i in (index, index + 1):
+            if self.flags[i] and self.keys[i] == key:
+                return TTEntry(TTFlag(self.flags[i]), int(self.values[i]), int(self.depths[i]), int(self.moves[i]))
+        return None
+
+    def store(self, key, flag, value, depth, move=NO_MOVE):
+        '''
+        move: best move encoded with move_encoding.encode_move(), or NO_MOVE.
+        '''
+        index = (key & self._mask) << 1
+        if (not self.flags[index] or self.keys[index] == key or self.ages[index] != self.age
+                or depth >= self.depths[index]):
+            i = index
+        else:
+            i = index + 1
+        self.keys[i] = key
+        self.values[i] = value
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.moves[i] = move
+        self.ages[i] = self.age
+
+    def hashfull(self):
+        '''
+        Permille of slots in use by the current search.
+        '''
+        return int(1000 * np.count_nonzero((self.flags != 0) & (self.ages == self.age)) // len(self.flags))
+
+class SharedTranspositionTable(TranspositionTable):
+    '''
+    TranspositionTable kept in a multiprocessing.shared_memory block, so several processes can
+    search with the same table (Lazy SMP). Create it in one process and open it by name in the
+    others with SharedTranspositionTable(size_mb, name).
+
+    Entries are written without locks, so a reader can see half of an entry another process is
+    writing. To detect this, the key is stored XORed with the rest of the entry, and probe() only
+    returns an entry whose key and data still match. The age is not shared, set it in each process.
+    '''
+
+    def __init__(self, size_mb=16, name=None):
+        self.shared_memory = shared_memory.SharedMemory(name=name, create=name is None, size=self.size(size_mb))
+        super().__init__(size_mb, self.shared_memory.buf)
+
+    @property
+    def name(self):
+        return self.shared_memory.name
+
+    def probe(self, key):
+        index = (key & self._mask) << 1
+        for i in (index, index + 1):
+            flag = int(self.flags[i])
+            if flag:
+                value, depth, move = int(self.values[i]), int(self.depths[i]), int(self.moves[i])
+                if int(self.keys[i]) ^ _entry_data(flag, value, depth, move) == key:
+                    return TTEntry(TTFlag(flag), value, depth, move)
+        return None
+
+    def store(self, key, flag, value, depth, move=NO_MOVE):
+        index = (key & self._mask) << 1
+        stored_key = int(self.keys[index]) ^ _entry_data(int(self.flags[index]), int(self.values[index]),
+                                                         int(self.depths[index]), int(self.moves[index]))
+        if (not self.flags[index] or stored_key == key or self.ages[index] != self.age
+                or depth >= self.depths[index]):
+            i = index
+        else:
+            i = index + 1
+        self.values[i] = value
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.moves[i] = move
+        self.ages[i] = self.age
+        self.keys[i] = key ^ _entry_data(int(flag), value, depth, move)
+
+    def close(self):
+        '''
+        Stop using the table in this process. The NumPy columns are dropped first, since the
+        shared memory cannot be closed while they point into it.
+        '''
+        self.keys = self.values = self.moves = self.depths = self.flags = self.ages = None
+        self.shared_memory.close()
+
+    def unlink(self):
+        '''
+        Free the shared memory, once every process has closed it.
+        '''
+        self.shared_memory.unlink()
+
+def _entry_data(flag, value, depth, move):
+    # Everything but the key and age packed into 64 bits
+    return (value & 0xFFFFFFFF) | depth << 32 | flag << 40 | move << 48
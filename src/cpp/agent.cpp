@@ -1,5 +1,10 @@
+#include <algorithm>
+#include <charconv>
 #include <iostream>
+#include <mutex>
+#include <sstream>
 #include <string>
+#include <thread>
 
 #include "chess.hpp"
 #include "utils.hpp"
@@ -8,28 +13,135 @@
 using namespace std;
 using namespace chess;
 
+// UCI protocol
+// https://www.chessprogramming.org/UCI
+// The search runs in its own thread so "stop" and "quit" are read while it searches.
+
+const int MAX_THREADS = 256;
+
+mutex output_mutex;
+
+void send(const string& line) {
+    lock_guard<mutex> lock(output_mutex);
+    cout << line << endl;
+}
+
+// position [startpos | fen <fen>] [moves <move1> ... <movei>]
+void set_position(Board& board, istringstream& command) {
+    string token, fen;
+    command >> token;
+    if (token == "startpos") {
+        fen = constants::STARTPOS;
+        command >> token; // "moves", if any
+    } else if (token == "fen") {
+        while (command >> token && token != "moves") fen += token + " ";
+    } else {
+        return;
+    }
+    board.setFen(fen);
+
+    // Playing the moves instead of only setting the final position keeps the history for repetitions.
+    // The move list stops at the first move that is not legal. uciToMove would read outside the board
+    // for text that is not a move, so the token is compared with the legal moves instead
+    while (command >> token) {
+        Movelist moves;
+        movegen::legalmoves(moves, board);
+        auto move = find_if(moves.begin(), moves.end(), [&token](Move m) { return uci::moveToUci(m) == token; });
+        if (move == moves.end()) break;
+        board.makeMove(*move);
+    }
+}
+
+// go [depth <d>] [movetime <ms>] [wtime <ms>] [btime <ms>] [winc <ms>] [binc <ms>] [movestogo <n>] [nodes <n>] [infinite]
+SearchLimits parse_limits(istringstream& command) {
+    SearchLimits limits;
+    string token;
+    while (command >> token) {
+        if (token == "depth") command >> limits.depth;
+        else if (token == "movetime") command >> limits.movetime;
+        else if (token == "wtime") command >> limits.wtime;
+        else if (token == "btime") command >> limits.btime;
+        else if (token == "winc") command >> limits.winc;
+        else if (token == "binc") command >> limits.binc;
+        else if (token == "movestogo") command >> limits.movestogo;
+        else if (token == "nodes") command >> limits.nodes;
+        else if (token == "infinite") limits.infinite = true;
+    }
+    return limits;
+}
+
+// setoption name <id> [value <x>]
+void set_option(MiniMaxAgent& agent, istringstream& command) {
+    string token, name, value;
+    command >> token; // "name"
+    while (command >> token && token != "value") name += (name.empty() ? "" : " ") + token;
+    while (command >> token) value += (value.empty() ? "" : " ") + token;
+
+    // Options with a missing or non-numeric value are ignored
+    long number = 0;
+    auto [end, error] = from_chars(value.data(), value.data() + value.size(), number);
+    if (error != errc() || end != value.data() + value.size()) return;
+
+    if (name == "Hash") {
+        agent.set_hash_size(clamp<long>(number, 1, TranspositionTable::MAX_SIZE_MB));
+    } else if (name == "Threads") {
+        agent.set_threads(clamp<long>(number, 1, MAX_THREADS));
+    }
+}
+
 int main() {
-    MiniMaxAgent negamax_agent;    
+    MiniMaxAgent negamax_agent;
+    negamax_agent.info_callback = send;
+    EvalBoard board;
+    thread search_thread;
     string user_input;
 
+    auto stop_search = [&]() {
+        negamax_agent.stop = true;
+        if (search_thread.joinable()) search_thread.join();
+    };
+
     // Interactive loop
-    while (true) {
-        getline(cin, user_input);
-        if (user_input == "quit") break;
-        if (user_input.rfind("depth ", 0) != 0) {
-            cout << "Expected depth command" << endl;   
-        }
-        int depth = atoi(user_input.substr(6).c_str());
-        getline(cin, user_input);
-        if (user_input.rfind("fen ", 0) != 0) {
-            cout << "Expected fen command" << endl;   
+    while (getline(cin, user_input)) {
+        istringstream command(user_input);
+        string token;
+        command >> token;
+
+        if (token == "uci") {
+            send("id name MiniMaxAgent");
+            send("id author chess-bots");
+            send("option name Hash type spin default " + to_string(TranspositionTable::DEFAULT_SIZE_MB)
+                 + " min 1 max " + to_string(TranspositionTable::MAX_SIZE_MB));
+            send("option name Threads type spin default 1 min 1 max " + to_string(MAX_THREADS));
+            send("uciok");
+        } else if (token == "isready") {
+            send("readyok");
+        } else if (token == "ucinewgame") {
+            stop_search();
+            negamax_agent.reset_transposition_table();
+        } else if (token == "setoption") {
+            stop_search();
+            set_option(negamax_agent, command);
+        } else if (token == "position") {
+            stop_search();
+            set_position(board, command);
+        } else if (token == "go") {
+            stop_search();
+            SearchLimits limits = parse_limits(command);
+            negamax_agent.stop = false;
+            search_thread = thread([&negamax_agent, limits, board]() mutable {
+                Move move = negamax_agent.search(board, larry_kaufman_pst_eval, limits);
+                // With go infinite the best move is only sent after stop
+                while (limits.infinite && !negamax_agent.stop) this_thread::sleep_for(chrono::milliseconds(1));
+                send("bestmove " + (move == Move::NO_MOVE ? string("0000") : uci::moveToUci(move)));
+            });
+        } else if (token == "stop") {
+            stop_search();
+        } else if (token == "quit") {
+            break;
         }
-        string fen = user_input.substr(4);
-        Board board(fen); // User input is chess fen
-        Color color = board.sideToMove();
-        Move move = negamax_agent.negamax(board, larry_kaufman_piece_sum, color, 3);
-        cout << uci::moveToUci(move) << endl;
     }
 
+    stop_search();
     return 0;
-}
\ No newline at end of file
+}
@@ -1 +1 @@
-g++ -std=c++23 -O3 -march=native -o main main.cpp negamax.cpp
+g++ -std=c++23 -O3 -march=native -pthread -o main main.cpp negamax.cpp
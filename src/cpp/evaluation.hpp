@@ -0,0 +1,182 @@
+#pragma once
+#include <array>
+#include <string_view>
+#include "chess.hpp"
+
+// Evaluation, the C++ versions of the heuristics in src/bots/heuristics.py.
+// All scores are in centipawns from white's point of view until the eval function
+// turns them around for maximising_player.
+
+// Larry Kaufman piece values, indexed by chess::PieceType
+// https://www.chess.com/article/view/the-evaluation-of-material-imbalances-by-im-larry-kaufman
+constexpr std::array<int, 6> LARRY_KAUFMAN_PIECE_VALUE = {100, 325, 325, 500, 975, 0}; // P, N, B, R, Q, K (king has no value)
+constexpr int BISHOP_PAIR_BONUS = 50;
+
+// Piece square tables indexed by chess::PieceType, then by square from a1 to h8, for white.
+// Black uses the table at 63 - square
+// https://www.chessprogramming.org/Simplified_Evaluation_Function
+constexpr std::array<std::array<int, 64>, 6> PIECE_SQUARE_TABLE = {{
+    { // Pawn
+          0,  0,  0,  0,  0,  0,  0,  0,
+          5, 10, 10,-20,-20, 10, 10,  5,
+          5, -5,-10,  0,  0,-10, -5,  5,
+          0,  0,  0, 20, 20,  0,  0,  0,
+          5,  5, 10, 25, 25, 10,  5,  5,
+         10, 10, 20, 30, 30, 20, 10, 10,
+         50, 50, 50, 50, 50, 50, 50, 50,
+          0,  0,  0,  0,  0,  0,  0,  0,
+    },
+    { // Knight
+        -50,-40,-30,-30,-30,-30,-40,-50,
+        -40,-20,  0,  5,  5,  0,-20,-40,
+        -30,  5, 10, 15, 15, 10,  5,-30,
+        -30,  0, 15, 20, 20, 15,  0,-30,
+        -30,  5, 15, 20, 20, 15,  5,-30,
+        -30,  0, 10, 15, 15, 10,  0,-30,
+        -40,-20,  0,  0,  0,  0,-20,-40,
+        -50,-40,-30,-30,-30,-30,-40,-50,
+    },
+    { // Bishop
+        -20,-10,-10,-10,-10,-10,-10,-20,
+        -10,  5,  0,  0,  0,  0,  5,-10,
+        -10, 10, 10, 10, 10, 10, 10,-10,
+        -10,  0, 10, 10, 10, 10,  0,-10,
+        -10,  5,  5, 10, 10,  5,  5,-10,
+        -10,  0,  5, 10, 10,  5,  0,-10,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -20,-10,-10,-10,-10,-10,-10,-20,
+    },
+    { // Rook
+          0,  0,  0,  5,  5,  0,  0,  0,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+         -5,  0,  0,  0,  0,  0,  0, -5,
+          5, 10, 10, 10, 10, 10, 10,  5,
+          0,  0,  0,  0,  0,  0,  0,  0,
+    },
+    { // Queen
+        -20,-10,-10, -5, -5,-10,-10,-20,
+        -10,  0,  5,  0,  0,  0,  0,-10,
+        -10,  5,  5,  5,  5,  5,  0,-10,
+          0,  0,  5,  5,  5,  5,  0, -5,
+         -5,  0,  5,  5,  5,  5,  0, -5,
+        -10,  0,  5,  5,  5,  5,  0,-10,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -20,-10,-10, -5, -5,-10,-10,-20,
+    },
+    { // King
+         20, 30, 10,  0,  0, 10, 30, 20,
+         20, 20,  0,  0,  0,  0, 20, 20,
+        -10,-20,-20,-20,-20,-20,-20,-10,
+        -20,-30,-30,-40,-40,-30,-30,-20,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+    },
+}};
+
+// Signed scores indexed by chess::Piece (white pieces, then black pieces), so updating a
+// sum for a piece on a square is one lookup
+constexpr std::array<int, 12> MATERIAL_SCORE = [] {
+    std::array<int, 12> score{};
+    for (int piece = 0; piece < 6; ++piece) {
+        score[piece] = LARRY_KAUFMAN_PIECE_VALUE[piece];
+        score[piece + 6] = -LARRY_KAUFMAN_PIECE_VALUE[piece];
+    }
+    return score;
+}();
+
+constexpr std::array<std::array<int, 64>, 12> PST_SCORE = [] {
+    std::array<std::array<int, 64>, 12> score{};
+    for (int piece = 0; piece < 6; ++piece) {
+        for (int sq = 0; sq < 64; ++sq) {
+            score[piece][sq] = PIECE_SQUARE_TABLE[piece][sq];
+            score[piece + 6][sq] = -PIECE_SQUARE_TABLE[piece][63 - sq];
+        }
+    }
+    return score;
+}();
+
+// Board that keeps the material and piece square table sums up to date as pieces are placed
+// and removed, so makeMove() and unmakeMove() update them and evaluating a leaf is a few
+// integer operations instead of a scan of the board.
+class EvalBoard : public chess::Board {
+    public:
+        explicit EvalBoard(std::string_view fen = chess::constants::STARTPOS) : chess::Board(fen) { refresh(); }
+
+        void setFen(std::string_view fen) override {
+            chess::Board::setFen(fen);
+            refresh();
+        }
+
+        int material_score() const { return material; }
+        int pst_score() const { return pst; }
+
+    protected:
+        void placePiece(chess::Piece piece, chess::Square sq) override {
+            chess::Board::placePiece(piece, sq);
+            material += MATERIAL_SCORE[int(piece)];
+            pst += PST_SCORE[int(piece)][sq.index()];
+        }
+
+        void removePiece(chess::Piece piece, chess::Square sq) override {
+            chess::Board::removePiece(piece, sq);
+            material -= MATERIAL_SCORE[int(piece)];
+            pst -= PST_SCORE[int(piece)][sq.index()];
+        }
+
+    private:
+        // Rescan the board. The base class places the pieces of a FEN without calling the overrides
+        // while it is being constructed, and clears the board without removing them one by one
+        void refresh() {
+            material = 0;
+            pst = 0;
+            for (int sq = 0; sq < 64; ++sq) {
+                chess::Piece piece = at(chess::Square(sq));
+                if (piece == chess::Piece::NONE) continue;
+                material += MATERIAL_SCORE[int(piece)];
+                pst += PST_SCORE[int(piece)][sq];
+            }
+        }
+
+        int material = 0;
+        int pst = 0;
+};
+
+inline int bishop_pair_score(const chess::Board& board) {
+    int score = 0;
+    if (board.pieces(chess::PieceType::BISHOP, chess::Color::WHITE).count() == 2) score += BISHOP_PAIR_BONUS;
+    if (board.pieces(chess::PieceType::BISHOP, chess::Color::BLACK).count() == 2) score -= BISHOP_PAIR_BONUS;
+    return score;
+}
+
+// Material with Larry Kaufman piece values and a bishop pair bonus, counted with popcounts
+inline int larry_kaufman_piece_sum(chess::Board& board, chess::Color maximising_player) {
+    int result = bishop_pair_score(board);
+    for (int pt = 0; pt < 5; ++pt) {
+        chess::PieceType piece_type = static_cast<chess::PieceType::underlying>(pt);
+        result += LARRY_KAUFMAN_PIECE_VALUE[pt] * (board.pieces(piece_type, chess::Color::WHITE).count()
+                                                   - board.pieces(piece_type, chess::Color::BLACK).count());
+    }
+    return maximising_player == chess::Color::WHITE ? result : -result;
+}
+
+// Same value as above, read from the board's running sum
+inline int larry_kaufman_piece_sum(EvalBoard& board, chess::Color maximising_player) {
+    int result = board.material_score() + bishop_pair_score(board);
+    return maximising_player == chess::Color::WHITE ? result : -result;
+}
+
+// Piece square tables only
+inline int piece_square_table_eval(EvalBoard& board, chess::Color maximising_player) {
+    return maximising_player == chess::Color::WHITE ? board.pst_score() : -board.pst_score();
+}
+
+// Material plus piece square tables
+inline int larry_kaufman_pst_eval(EvalBoard& board, chess::Color maximising_player) {
+    int result = board.material_score() + bishop_pair_score(board) + board.pst_score();
+    return maximising_player == chess::Color::WHITE ? result : -result;
+}
@@ -62,7 +62,7 @@ int get_statistics(int no_games)
 
     std::vector<int> win_count = {0, 0}; // white, black
     for (int test_case = 0; test_case < no_games; ++test_case) {
-        Board board;
+        EvalBoard board;
         int n = 1;
         std::stringstream move_history;
 
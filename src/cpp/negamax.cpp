@@ -1,4 +1,8 @@
+#include <algorithm>
 #include <limits>
+#include <thread>
+#include <vector>
+#include <sstream>
 #include "chess.hpp"
 #include "utils.hpp"
 #include "negamax.hpp"
@@ -10,37 +14,10 @@ const int DRAW_VALUE = 0;
 const float POSTIIVE_INFINITY = std::numeric_limits<float>::infinity();
 const float NEGATIVE_INFINITY = -std::numeric_limits<float>::infinity();
 
-int larry_kaufman_piece_sum(Board &board, Color maximising_player) {
-    
-    std::unordered_map<PieceType, int, EnumClassHash> piece_value = {
-        {PieceType::PAWN, 100},
-        {PieceType::BISHOP, 325},
-        {PieceType::KNIGHT, 325},
-        {PieceType::ROOK, 500},
-        {PieceType::QUEEN, 975},
-        {PieceType::KING, 0}, // King has no value
-        {PieceType::NONE, 0},
-    };
-
-    int result = 0;
-    std::array<int, 2> bishop_count = {0, 0}; // (white bishop, black bishop)
-
-    for (int i = 0; i < 64; ++i) {
-        Piece piece = board.at(Square(i));
-        if (piece.type() != PieceType::NONE) {
-            if (piece.color() == Color::WHITE) {
-                result += piece_value[piece.type()];
-            } else {
-                result -= piece_value[piece.type()];
-            }
-        }
-    }
-    
-    if (maximising_player == Color::WHITE) {
-        return result;
-    }
-    return -result;
-}
+// Depth searched by MiniMaxAgent::search when the go command has no limits at all
+const int DEFAULT_DEPTH = 4;
+// Expected number of moves left in the game, used to split the remaining clock time
+const int MOVES_TO_GO = 30;
 
 Move negamax(Board& board, int (*eval_func)(Board&, Color), Color player_color, int depth=2) 
 {
@@ -89,87 +66,136 @@ Move negamax(Board& board, int (*eval_func)(Board&, Color), Color player_color,
 }
 
 
-Move MiniMaxAgent::negamax(Board& board, int (*eval_func)(Board&, Color), Color player_color, int depth=2) 
-{
-    // Capturing private class member in lamabda using "this"
-    auto _negamax = [&board, &eval_func, this](int depth, int color, float alpha, float beta, const auto& _negamax) -> std::pair<Move, float>
-    {
-        float alpha_original = alpha;
-
-        auto tt_key = board.hash();
-        if (transposition_table.find(tt_key) != transposition_table.end() && transposition_table[tt_key].depth >= depth) {
-            auto& tt_entry = transposition_table[tt_key];
-            if (tt_entry.flag == TTFlag::EXACT)
-                return { tt_entry.move, tt_entry.value };
-            else if (tt_entry.flag == TTFlag::LOWERBOUND)
-                alpha = std::max(alpha, tt_entry.value);
-            else if (tt_entry.flag == TTFlag::UPPERBOUND)
-                beta = std::min(beta, tt_entry.value);
-            if (alpha >= beta)
-                return { tt_entry.move, tt_entry.value };
-        }
+// Move ordering scores, they have to fit in the 16 bit score of a chess::Move
+// https://www.chessprogramming.org/Move_Ordering
+const int TT_MOVE_SCORE = 30000;
+const int CAPTURE_SCORE = 20000;
+const int PROMOTION_SCORE = 19000;
+const int KILLER_SCORE = 18000;
+// History scores are halved when one reaches this, so they stay below KILLER_SCORE
+const int HISTORY_MAX = 1 << 14;
 
-        auto outcome = board.isGameOver().second;
-        if (outcome == GameResult::DRAW) return std::pair(NULL, DRAW_VALUE);
-        bool is_white_win = (outcome == GameResult::WIN && board.sideToMove() == Color::WHITE) || 
-            (outcome == GameResult::LOSE && board.sideToMove() == Color::BLACK);       
-        if (is_white_win) return std::pair(NULL, color * WIN_VALUE);
-        bool is_black_win = (outcome == GameResult::WIN && board.sideToMove() == Color::BLACK) || 
-            (outcome == GameResult::LOSE && board.sideToMove() == Color::WHITE);
-        if (is_black_win) return std::pair(NULL, - color * WIN_VALUE);
+MiniMaxAgent::MiniMaxAgent(TranspositionTable& shared_table)
+    : own_transposition_table(0), transposition_table(shared_table)
+{
+}
 
-        if (depth == 0) return std::pair(NULL, color * eval_func(board, Color::WHITE));
+void MiniMaxAgent::reset_transposition_table()
+{
+    transposition_table.clear();
+}
 
-        float best_move_value = NEGATIVE_INFINITY;
-        Move best_move;
+void MiniMaxAgent::set_hash_size(std::size_t size_mb)
+{
+    transposition_table.resize(size_mb);
+}
 
-        Movelist moves;
-        movegen::legalmoves(moves, board);
-        for (const auto &move : moves) {
-            board.makeMove(move);
-            auto [current_move, current_value] = _negamax(depth - 1, -color, -beta, -alpha, _negamax); // Use recursive lambdas
-            current_value = - current_value;
-            board.unmakeMove(move);
+void MiniMaxAgent::set_threads(int threads)
+{
+    helpers.clear();
+    for (int i = 1; i < threads; i++) {
+        helpers.push_back(std::make_unique<MiniMaxAgent>(transposition_table));
+    }
+}
 
-            if (current_value > best_move_value) {
-                best_move = move;
-                best_move_value = current_value;
-            }
+uint64_t MiniMaxAgent::total_nodes() const
+{
+    uint64_t total = nodes.load(std::memory_order_relaxed);
+    for (const auto& helper : helpers) total += helper->nodes.load(std::memory_order_relaxed);
+    return total;
+}
 
-            if (best_move_value > beta) {
-                return std::pair(best_move, best_move_value);
-            }
+void MiniMaxAgent::new_search()
+{
+    // Killers are by ply from the root, which changed. Older history counts less
+    killers = {};
+    for (auto& from : history)
+        for (auto& to : from)
+            for (auto& score : to) score >>= 1;
+}
 
-            alpha = std::max(alpha, best_move_value);
+void MiniMaxAgent::order_moves(const EvalBoard& board, Movelist& moves, Move tt_move, int ply)
+{
+    // The transposition table move first, then captures by MVV-LVA (most valuable victim, least
+    // valuable attacker), promotions, killer moves, and quiet moves by history score
+    const auto& ply_killers = killers[std::min(ply, MAX_DEPTH - 1)];
+    const auto& color_history = history[board.sideToMove()];
+    for (auto& move : moves) {
+        int score;
+        Piece captured = move.typeOf() == Move::ENPASSANT ? Piece(PieceType::PAWN, ~board.sideToMove())
+                       : move.typeOf() == Move::CASTLING ? Piece(Piece::NONE) : board.at(move.to());
+        if (move == tt_move) {
+            score = TT_MOVE_SCORE;
+        } else if (captured != Piece::NONE) {
+            score = CAPTURE_SCORE + 10 * int(captured.type()) - int(board.at(move.from()).type());
+        } else if (move.typeOf() == Move::PROMOTION) {
+            score = PROMOTION_SCORE + int(move.promotionType());
+        } else if (move.move() == ply_killers[0]) {
+            score = KILLER_SCORE;
+        } else if (move.move() == ply_killers[1]) {
+            score = KILLER_SCORE - 1;
+        } else {
+            score = color_history[move.from().index()][move.to().index()];
         }
+        move.setScore(static_cast<int16_t>(score));
+    }
+    std::stable_sort(moves.begin(), moves.end(), [](const Move& a, const Move& b) { return a.score() > b.score(); });
+}
 
-        TTFlag newflag = TTFlag::EXACT;
-        if (best_move_value <= alpha_original)
-            newflag = TTFlag::UPPERBOUND;
-        else if (best_move_value >= beta)
-            newflag = TTFlag::LOWERBOUND;
-        TTEntry new_tt_entry{newflag, best_move_value, depth, best_move};
-        transposition_table[tt_key] = new_tt_entry;
+void MiniMaxAgent::record_cutoff(const EvalBoard& board, Move move, int ply, int depth)
+{
+    // Captures and promotions are already ordered first, so only quiet moves are recorded
+    if (move.typeOf() == Move::PROMOTION || move.typeOf() == Move::ENPASSANT
+        || (move.typeOf() != Move::CASTLING && board.at(move.to()) != Piece::NONE)) return;
 
+    if (ply < MAX_DEPTH && killers[ply][0] != move.move()) {
+        killers[ply][1] = killers[ply][0];
+        killers[ply][0] = move.move();
+    }
 
-        return std::pair(best_move, best_move_value);
-    };
+    int& score = history[board.sideToMove()][move.from().index()][move.to().index()];
+    score += depth * depth;
+    if (score >= HISTORY_MAX) {
+        for (auto& from : history)
+            for (auto& to : from)
+                for (auto& s : to) s >>= 1;
+    }
+}
 
-    int color = player_color == Color::WHITE? 1 : -1;
-    auto [current_move, current_value] = _negamax(depth, color, NEGATIVE_INFINITY, POSTIIVE_INFINITY, _negamax);
-    return current_move;
-};
+bool MiniMaxAgent::out_of_time()
+{
+    // Reading the clock is slow, only do it every 1024 nodes
+    uint64_t searched = nodes.load(std::memory_order_relaxed);
+    if (stop.load(std::memory_order_relaxed)) return true;
+    // The node limit counts the Lazy SMP helpers' nodes too, like the nodes reported in info lines
+    if (node_limit && total_nodes() >= node_limit) return true;
+    return has_deadline && (searched & 1023) == 0 && std::chrono::steady_clock::now() >= deadline;
+}
 
-Move MiniMaxAgent::iterative_deepening(Board& board, int (*eval_func)(Board&, Color), Color player_color, int depth=2) 
+Move MiniMaxAgent::negamax(EvalBoard& board, int (*eval_func)(EvalBoard&, Color), Color player_color, int depth=2) 
 {
+    const int root_depth = depth;
+    aborted = false;
+
     // Capturing private class member in lamabda using "this"
-    auto _negamax = [&board, &eval_func, this](int depth, int color, float alpha, float beta, const auto& _negamax) -> std::pair<Move, float>
+    auto _negamax = [&board, &eval_func, root_depth, this](int depth, int color, float alpha, float beta, const auto& _negamax) -> std::pair<Move, float>
     {
+        // Once aborted, every node returns straight away and its result is thrown away.
+        // Only this thread writes nodes, so it does not need an atomic increment
+        nodes.store(nodes.load(std::memory_order_relaxed) + 1, std::memory_order_relaxed);
+        if (aborted || out_of_time()) {
+            aborted = true;
+            return std::pair(Move::NO_MOVE, 0);
+        }
+
         float alpha_original = alpha;
 
+        // The root is always searched, so its move comes from this search. Leaves are never
+        // stored, so probing them only costs a cache miss
         auto tt_key = board.hash();
-        if (transposition_table.find(tt_key) != transposition_table.end() && transposition_table[tt_key].depth >= depth) {
-            auto& tt_entry = transposition_table[tt_key];
+        TTEntry tt_entry;
+        bool tt_hit = depth > 0 && transposition_table.probe(tt_key, tt_entry);
+        if (tt_hit && depth < root_depth && tt_entry.depth >= depth) {
             if (tt_entry.flag == TTFlag::EXACT)
                 return { tt_entry.move, tt_entry.value };
             else if (tt_entry.flag == TTFlag::LOWERBOUND)
@@ -192,23 +218,34 @@ Move MiniMaxAgent::iterative_deepening(Board& board, int (*eval_func)(Board&, Co
         if (depth == 0) return std::pair(NULL, color * eval_func(board, Color::WHITE));
 
         float best_move_value = NEGATIVE_INFINITY;
-        Move best_move;
+        Move best_move = Move::NO_MOVE;
 
         Movelist moves;
         movegen::legalmoves(moves, board);
+
+        // The best move of a shallower search goes first, at the root that is the previous
+        // iteration's move. A different position sharing the slot only matches an illegal move
+        int ply = root_depth - depth;
+        order_moves(board, moves, tt_hit ? tt_entry.move : Move(Move::NO_MOVE), ply);
+
         for (const auto &move : moves) {
             board.makeMove(move);
             auto [current_move, current_value] = _negamax(depth - 1, -color, -beta, -alpha, _negamax); // Use recursive lambdas
             current_value = - current_value;
             board.unmakeMove(move);
 
+            // Keep the moves searched completely, at the root they are still worth playing
+            if (aborted) return std::pair(best_move, best_move_value);
+
             if (current_value > best_move_value) {
                 best_move = move;
                 best_move_value = current_value;
             }
 
+            // Store cutoffs as lower bounds, the other threads can use them too
             if (best_move_value > beta) {
-                return std::pair(best_move, best_move_value);
+                record_cutoff(board, move, ply, depth);
+                break;
             }
 
             alpha = std::max(alpha, best_move_value);
@@ -219,24 +256,144 @@ Move MiniMaxAgent::iterative_deepening(Board& board, int (*eval_func)(Board&, Co
             newflag = TTFlag::UPPERBOUND;
         else if (best_move_value >= beta)
             newflag = TTFlag::LOWERBOUND;
-        TTEntry new_tt_entry{newflag, best_move_value, depth, best_move};
-        transposition_table[tt_key] = new_tt_entry;
+        transposition_table.store(tt_key, newflag, best_move_value, depth, best_move);
 
 
         return std::pair(best_move, best_move_value);
     };
 
     int color = player_color == Color::WHITE? 1 : -1;
-    Move best_move;
-    float best_value = NEGATIVE_INFINITY;
-
-    for (int d = 0; d < depth; d++) {
-        auto [current_move, current_value] = _negamax(depth, color, NEGATIVE_INFINITY, POSTIIVE_INFINITY, _negamax);
-        if (current_value > best_value) {
-            best_move = current_move;
-            best_value = current_value;
+    auto [current_move, current_value] = _negamax(depth, color, NEGATIVE_INFINITY, POSTIIVE_INFINITY, _negamax);
+    last_score = current_value;
+    return current_move;
+};
+
+Move MiniMaxAgent::iterative_deepening(EvalBoard& board, int (*eval_func)(EvalBoard&, Color), Color player_color, int depth, int start_depth) 
+{
+    // Search depth start_depth, start_depth + 1, ... up to depth and keep the move of the last
+    // completed iteration. The transposition table is kept between iterations, so each one searches
+    // the previous best moves first. An iteration aborted by search()'s limits is thrown away.
+    Move best_move = Move::NO_MOVE;
+    float best_value = 0;
+    completed_depth = 0;
+
+    for (int d = start_depth; d <= depth; d++) {
+        Move current_move = negamax(board, eval_func, player_color, d);
+        if (aborted) break;
+
+        best_move = current_move;
+        best_value = last_score;
+        completed_depth = d;
+        send_info(board, d, best_move);
+
+        // The next iteration takes several times longer, do not start it if it cannot finish
+        if (has_deadline && std::chrono::steady_clock::now() - start_time > (deadline - start_time) / 2) break;
+    }
+
+    // An aborted iteration can leave the score of a partial search behind
+    last_score = best_value;
+    return best_move;
+};
+
+void MiniMaxAgent::send_info(EvalBoard& board, int depth, Move best_move)
+{
+    if (!info_callback) return;
+
+    auto elapsed = std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::steady_clock::now() - start_time).count();
+    std::ostringstream info;
+    uint64_t searched = total_nodes();
+    info << "info depth " << depth << " score cp " << static_cast<int>(last_score) << " nodes " << searched
+         << " nps " << searched * 1000 / (elapsed + 1) << " time " << elapsed
+         << " hashfull " << transposition_table.hashfull();
+
+    // Follow the best moves stored in the transposition table from the root
+    if (best_move != Move::NO_MOVE) {
+        info << " pv";
+        std::vector<Move> pv = {best_move};
+        board.makeMove(best_move);
+        TTEntry tt_entry;
+        while (static_cast<int>(pv.size()) < depth && transposition_table.probe(board.hash(), tt_entry)) {
+            Movelist moves;
+            movegen::legalmoves(moves, board);
+            if (std::find(moves.begin(), moves.end(), tt_entry.move) == moves.end()) break;
+            pv.push_back(tt_entry.move);
+            board.makeMove(tt_entry.move);
         }
+        for (auto move = pv.rbegin(); move != pv.rend(); ++move) {
+            board.unmakeMove(*move);
+        }
+        for (const auto& move : pv) info << " " << uci::moveToUci(move);
     }
-    
+    info_callback(info.str());
+}
+
+Move MiniMaxAgent::search(EvalBoard& board, int (*eval_func)(EvalBoard&, Color), const SearchLimits& limits)
+{
+    start_time = std::chrono::steady_clock::now();
+    nodes = 0;
+    node_limit = limits.nodes;
+    transposition_table.new_search();
+    new_search();
+
+    int time_limit = limits.movetime;
+    int remaining = board.sideToMove() == Color::WHITE ? limits.wtime : limits.btime;
+    int increment = board.sideToMove() == Color::WHITE ? limits.winc : limits.binc;
+    if (!time_limit && !limits.infinite && remaining) {
+        int moves_to_go = limits.movestogo ? limits.movestogo : MOVES_TO_GO;
+        // Never use more than half of the remaining time on one move
+        time_limit = std::min(remaining / moves_to_go + increment * 3 / 4, remaining / 2);
+        // A nearly empty clock rounds down to 0, which would mean no deadline at all
+        time_limit = std::clamp(time_limit, 1, std::max(remaining - 1, 1));
+    }
+    has_deadline = time_limit > 0;
+    deadline = start_time + std::chrono::milliseconds(time_limit);
+
+    // Without a depth, search until the time, node limit or stop ends it
+    int depth = limits.depth;
+    if (!depth) depth = has_deadline || node_limit || limits.infinite ? MAX_DEPTH : DEFAULT_DEPTH;
+
+    // Lazy SMP: the helpers search the same position on their own board copies until this thread
+    // is done, every other one starting a ply deeper, and share what they find through the
+    // transposition table. The limits are only checked here
+    // https://www.chessprogramming.org/Lazy_SMP
+    std::vector<Move> helper_moves(helpers.size(), Move(Move::NO_MOVE));
+    std::vector<std::thread> threads;
+    for (std::size_t i = 0; i < helpers.size(); i++) {
+        MiniMaxAgent& helper = *helpers[i];
+        helper.stop = false;
+        helper.nodes = 0;
+        helper.new_search();
+        int start_depth = 1 + (i + 1) % 2;
+        threads.emplace_back([&helper, &helper_moves, i, board, eval_func, depth, start_depth]() mutable {
+            helper_moves[i] = helper.iterative_deepening(board, eval_func, board.sideToMove(), depth, start_depth);
+        });
+    }
+
+    Move best_move = iterative_deepening(board, eval_func, board.sideToMove(), depth);
+
+    for (auto& helper : helpers) helper->stop = true;
+    for (auto& thread : threads) thread.join();
+
+    // Play the move of the deepest completed iteration
+    nodes = total_nodes();
+    for (std::size_t i = 0; i < helpers.size(); i++) {
+        if (helpers[i]->completed_depth > completed_depth) {
+            best_move = helper_moves[i];
+            last_score = helpers[i]->last_score;
+            completed_depth = helpers[i]->completed_depth;
+        }
+    }
+
+    // Aborted before the first iteration finished
+    if (best_move == Move::NO_MOVE) {
+        Movelist moves;
+        movegen::legalmoves(moves, board);
+        if (!moves.empty()) best_move = moves[0];
+        last_score = 0;
+    }
+
+    // The limits only apply inside search(), not to later direct calls of negamax()
+    has_deadline = false;
+    node_limit = 0;
     return best_move;
-};
\ No newline at end of file
+}
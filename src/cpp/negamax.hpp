@@ -1,37 +1,101 @@
 #pragma once
+#include <array>
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <functional>
+#include <memory>
+#include <string>
+#include <vector>
 #include "chess.hpp"
-
-int larry_kaufman_piece_sum(chess::Board&, chess::Color);
+#include "evaluation.hpp"
+#include "transposition_table.hpp"
 
 chess::Move negamax(chess::Board& board, int (*eval_func)(chess::Board&, chess::Color), chess::Color player_color, int depth);
 
 chess::Move negamax_tt(chess::Board& board, int (*eval_func)(chess::Board&, chess::Color), chess::Color player_color, int depth);
 
+// Limits of a search, as given by the UCI go command. 0 means no limit, times are in milliseconds
+struct SearchLimits {
+    int depth = 0;
+    int movetime = 0;
+    int wtime = 0;
+    int btime = 0;
+    int winc = 0;
+    int binc = 0;
+    int movestogo = 0;
+    uint64_t nodes = 0;
+    bool infinite = false;
+};
+
 class MiniMaxAgent {
     public:
-        enum class TTFlag { EXACT = 1, UPPERBOUND = 2, LOWERBOUND = 3 };
-
-        struct TTEntry {
-            TTFlag flag;
-            float value;
-            int depth;
-            chess::Move move;
-        };
+        // Deepest iteration of iterative deepening
+        static constexpr int MAX_DEPTH = 64;
 
         // Constructor
         MiniMaxAgent() = default;
 
+        // Helper for Lazy SMP, searching with another agent's transposition table
+        explicit MiniMaxAgent(TranspositionTable& shared_table);
+
         // Destructor
         ~MiniMaxAgent() = default;
 
         // Reset the transposition table
         void reset_transposition_table();
 
+        // Reallocate the transposition table with size_mb megabytes (UCI Hash option)
+        void set_hash_size(std::size_t size_mb);
+
+        // Search with this many threads sharing the transposition table (UCI Threads option)
+        void set_threads(int threads);
+
         // Negamax function
-        chess::Move negamax(chess::Board& board, int (*eval_func)(chess::Board&, chess::Color), chess::Color player_color, int depth);
+        chess::Move negamax(EvalBoard& board, int (*eval_func)(EvalBoard&, chess::Color), chess::Color player_color, int depth);
+
+        // Search start_depth to depth, returning the move of the deepest completed iteration
+        chess::Move iterative_deepening(EvalBoard& board, int (*eval_func)(EvalBoard&, chess::Color), chess::Color player_color, int depth, int start_depth = 1);
+
+        // Iterative deepening within the limits of a UCI go command, reporting every iteration to info_callback
+        chess::Move search(EvalBoard& board, int (*eval_func)(EvalBoard&, chess::Color), const SearchLimits& limits);
 
-        chess::Move iterative_deepening(chess::Board& board, int (*eval_func)(chess::Board&, chess::Color), chess::Color player_color, int depth);
+        // Set from another thread to abort the search, which then returns the move of the last completed iteration
+        std::atomic<bool> stop{false};
+
+        // Receives a UCI info line after each iteration, if set
+        std::function<void(const std::string&)> info_callback;
+
+        // Statistics of the last search. nodes includes the helpers' nodes, and is read while they search
+        std::atomic<uint64_t> nodes{0};
+        float last_score = 0;
+        int completed_depth = 0;
     private:
         // Private member variables
-        std::unordered_map<uint64_t, TTEntry> transposition_table;
-};
\ No newline at end of file
+        TranspositionTable own_transposition_table;
+        TranspositionTable& transposition_table = own_transposition_table;
+
+        // Lazy SMP helpers, each with its own killers and history
+        std::vector<std::unique_ptr<MiniMaxAgent>> helpers;
+
+        // Move ordering: killer moves by ply, and history scores of quiet moves by [color][from][to]
+        std::array<std::array<uint16_t, 2>, MAX_DEPTH> killers{};
+        std::array<std::array<std::array<int, 64>, 64>, 2> history{};
+
+        // Limits of the running search, checked every node by out_of_time() of the main thread only.
+        // node_limit counts the nodes of all threads, and the helpers stop once the main thread stops
+        std::chrono::steady_clock::time_point start_time;
+        std::chrono::steady_clock::time_point deadline;
+        bool has_deadline = false;
+        uint64_t node_limit = 0;
+        bool aborted = false;
+
+        bool out_of_time();
+
+        void new_search();
+        void order_moves(const EvalBoard& board, chess::Movelist& moves, chess::Move tt_move, int ply);
+        void record_cutoff(const EvalBoard& board, chess::Move move, int ply, int depth);
+        uint64_t total_nodes() const;
+
+        void send_info(EvalBoard& board, int depth, chess::Move best_move);
+};
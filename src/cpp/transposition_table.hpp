@@ -0,0 +1,140 @@
+#pragma once
+#include <algorithm>
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+#include <memory>
+#include "chess.hpp"
+
+// Transposition table
+// https://www.chessprogramming.org/Transposition_Table
+
+enum class TTFlag : uint8_t { NONE = 0, EXACT = 1, UPPERBOUND = 2, LOWERBOUND = 3 };
+
+// Entry returned by TranspositionTable::probe
+struct TTEntry {
+    TTFlag flag;
+    float value;
+    int depth;
+    chess::Move move;
+};
+
+class TranspositionTable {
+    public:
+        static constexpr std::size_t DEFAULT_SIZE_MB = 16;
+        static constexpr std::size_t MAX_SIZE_MB = 4096;
+
+        explicit TranspositionTable(std::size_t size_mb = DEFAULT_SIZE_MB) { resize(size_mb); }
+
+        // Reallocate the table with size_mb megabytes, rounded down to a power of two buckets. Clears it
+        void resize(std::size_t size_mb) {
+            std::size_t bucket_count = std::max<std::size_t>(1, size_mb * 1024 * 1024 / sizeof(Bucket));
+            while (bucket_count & (bucket_count - 1)) bucket_count &= bucket_count - 1;
+            buckets.reset(new Bucket[bucket_count]());
+            mask = bucket_count - 1;
+            age = 0;
+        }
+
+        void clear() {
+            for (std::size_t i = 0; i <= mask; ++i) {
+                for (Slot& slot : buckets[i].slots) {
+                    slot.key.store(0, std::memory_order_relaxed);
+                    slot.data.store(0, std::memory_order_relaxed);
+                }
+            }
+            age = 0;
+        }
+
+        // Call before searching a new position, so entries from earlier searches are replaced first
+        void new_search() { age = (age + 1) & AGE_MASK; }
+
+        // Find key in its bucket. Only the bucket's cache line is read
+        bool probe(uint64_t key, TTEntry& entry) const {
+            for (const Slot& slot : buckets[key & mask].slots) {
+                uint64_t data = slot.data.load(std::memory_order_relaxed);
+                if ((slot.key.load(std::memory_order_relaxed) ^ data) == key && flag_of(data)) {
+                    float value;
+                    uint32_t value_bits = static_cast<uint32_t>(data);
+                    std::memcpy(&value, &value_bits, sizeof(value));
+                    entry = { static_cast<TTFlag>(flag_of(data)), value, depth_of(data),
+                              chess::Move(static_cast<uint16_t>(data >> 32)) };
+                    return true;
+                }
+            }
+            return false;
+        }
+
+        // Overwrite the slot holding key if there is one. Otherwise replace the slot with the least
+        // depth, counting slots from earlier searches as shallower than any slot of this search
+        void store(uint64_t key, TTFlag flag, float value, int depth, chess::Move move) {
+            Slot* replace = nullptr;
+            int replace_priority = 0;
+            for (Slot& slot : buckets[key & mask].slots) {
+                uint64_t data = slot.data.load(std::memory_order_relaxed);
+                if ((slot.key.load(std::memory_order_relaxed) ^ data) == key || !flag_of(data)) {
+                    // Keep the old best move if this search has none for the position
+                    if (move == chess::Move::NO_MOVE && flag_of(data)) move = chess::Move(static_cast<uint16_t>(data >> 32));
+                    replace = &slot;
+                    break;
+                }
+                int slot_priority = age_of(data) == age ? depth_of(data) + 256 : depth_of(data);
+                if (!replace || slot_priority < replace_priority) {
+                    replace = &slot;
+                    replace_priority = slot_priority;
+                }
+            }
+
+            uint32_t value_bits;
+            std::memcpy(&value_bits, &value, sizeof(value));
+            uint64_t data = value_bits
+                | static_cast<uint64_t>(move.move()) << 32
+                | static_cast<uint64_t>(static_cast<uint8_t>(std::min(depth, 127))) << 48
+                | static_cast<uint64_t>(flag) << 56
+                | static_cast<uint64_t>(age) << 58;
+            replace->key.store(key ^ data, std::memory_order_relaxed);
+            replace->data.store(data, std::memory_order_relaxed);
+        }
+
+        // Permille of the first 1000 slots used by the current search, for the UCI hashfull field
+        int hashfull() const {
+            int used = 0, total = 0;
+            for (std::size_t i = 0; i <= mask && total < 1000; ++i) {
+                for (const Slot& slot : buckets[i].slots) {
+                    uint64_t data = slot.data.load(std::memory_order_relaxed);
+                    used += flag_of(data) && age_of(data) == age;
+                    ++total;
+                }
+            }
+            return used * 1000 / total;
+        }
+
+    private:
+        static constexpr uint8_t AGE_MASK = 0x3F;
+
+        // Several threads share the table without locks (Lazy SMP), so a probe can read a slot while
+        // another thread is halfway through writing it. The key is stored XORed with the data, and a
+        // torn slot no longer matches its key. data holds, from the low bits: value (float bits, 32),
+        // move (16), depth (8), flag (2), age (6). A flag of 0 means empty
+        struct Slot {
+            std::atomic<uint64_t> key;
+            std::atomic<uint64_t> data;
+        };
+
+        // Four slots fill one 64 byte cache line
+        struct alignas(64) Bucket {
+            Slot slots[4];
+        };
+
+        static_assert(std::atomic<uint64_t>::is_always_lock_free);
+        static_assert(sizeof(Slot) == 16);
+        static_assert(sizeof(Bucket) == 64);
+
+        static int flag_of(uint64_t data) { return (data >> 56) & 3; }
+        static int depth_of(uint64_t data) { return static_cast<int8_t>(data >> 48); }
+        static uint8_t age_of(uint64_t data) { return (data >> 58) & AGE_MASK; }
+
+        std::unique_ptr<Bucket[]> buckets;
+        std::size_t mask = 0;
+        uint8_t age = 0;
+};
@@ -5,6 +5,7 @@ Evaluate ELO by benchmarking against stockfish with different elo
 import chess
 import chess.pgn
 import itertools
+import random
 import sys
 import os
 import pandas as pd
@@ -15,6 +16,15 @@ from bots.komodo_bot import KomodoBot
 from bots.minimax_bot_cpp import MinimaxBot
 from bots.negamax_bot import NegaMaxAgent
 from bots.minimax_bot import MiniMaxAgent
+from bots.heuristics import (piece_count, piece_count_bitboard, larry_kaufman_piece_sum,
+                             larry_kaufman_piece_sum_bitboard, piece_square_table_eval,
+                             piece_square_table_eval_bitboard, batch_evaluate, IncrementalEvaluator,
+                             pawn_zobrist_hash)
+
+def print_nodes(bot):
+    # Bots written in python count their search in bot.stats, the engines don't
+    if hasattr(bot, "stats"):
+        print(f"nodes {bot.stats.nodes} qnodes {bot.stats.qnodes}")
 
 def mate_in_1_test(bot):
     print(f"mate_in_1_test: {bot.name}")
@@ -28,6 +38,7 @@ def mate_in_1_test(bot):
         board = chess.Board(fen)
         current_color = board.turn
         move = bot.make_move(board)
+        print_nodes(bot)
         board.push(move)
         if not board.outcome():
             print("Mate in 1 test failed: Game has not ended")
@@ -49,6 +60,7 @@ def mate_in_2_test(bot):
         board = chess.Board(fen)
         current_color = board.turn
         move = bot.make_move(board)
+        print_nodes(bot)
         board.push(move)
         print(move)
         board_copy = board.copy()
@@ -73,7 +85,145 @@ def mate_in_2_test(bot):
                 break
             else:
                 print("Mate in 2 test passed")     
-    
+
+def horizon_stalemate_test():
+    # Qxb4 wins a pawn but leaves black with no moves. The searches must see the stalemate
+    # at the horizon without quiescence search
+    print("horizon_stalemate_test")
+    fen = "8/p7/k7/8/1p4Q1/8/7K/8 w - - 0 1"
+    bots = [
+        MiniMaxAgent("MiniMaxAB", depth=1, use_quiescence=False),
+        MiniMaxAgent("MiniMax", ab_pruning=False, depth=1),
+        NegaMaxAgent("NegaMaxTT", depth=1, use_quiescence=False),
+        NegaMaxAgent("NegaMax", use_transposition_table=False, depth=1, use_quiescence=False),
+    ]
+
+    for bot in bots:
+        board = chess.Board(fen)
+        board.push(bot.make_move(board))
+        bot.close()
+        if board.is_stalemate():
+            print(f"Horizon stalemate test failed: {bot.name} played into stalemate")
+        else:
+            print(f"Horizon stalemate test passed: {bot.name}")
+
+def move_ordering_test():
+    # Move ordering should search fewer nodes without changing the moves played
+    print("move_ordering_test")
+    test_fens = [
+        "7B/8/8/8/8/8/pr6/k3K2R w K - 0 1",
+        "kbK5/pp6/1P6/8/8/8/8/R7 w - - 0 1",
+    ]
+
+    for make_bot in [lambda move_ordering: MiniMaxAgent("MiniMaxAB", depth=3, move_ordering=move_ordering),
+                     lambda move_ordering: NegaMaxAgent("NegaMaxTT", depth=3, move_ordering=move_ordering),
+                     lambda move_ordering: NegaMaxAgent("NegaMax", depth=3, use_transposition_table=False,
+                                                        move_ordering=move_ordering)]:
+        for fen in test_fens:
+            moves, nodes = [], []
+            for move_ordering in [False, True]:
+                bot = make_bot(move_ordering)
+                moves.append(bot.make_move(chess.Board(fen)))
+                nodes.append(bot.stats.nodes + bot.stats.qnodes)
+                bot.close()
+            print(f"{bot.name} {fen}: {nodes[0]} nodes without move ordering, {nodes[1]} with")
+            if moves[0] != moves[1]:
+                print(f"Move ordering test failed: {moves[1]} played instead of {moves[0]}")
+
+def random_positions(count, seed=0):
+    # Positions reached by playing random moves from the start, skipping finished games
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        board = chess.Board()
+        for _ in range(rng.randint(10, 40)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        if not board.is_game_over():
+            fens.append(board.fen())
+    return fens
+
+def transposition_table_test():
+    # The transposition table and the quiescence bounds stored in it must not change the score
+    # of a fixed depth search. Selective search prunes differently with and without the table
+    print("transposition_table_test")
+    test_fens = [
+        "rnbq1br1/p1ppp1p1/1p2k3/2P2n1p/P3p3/5PNP/1P1P2P1/RNBQKBR1 b Q - 1 10", # Delta pruning once gave f5g3
+    ] + random_positions(20)
+
+    failed = 0
+    for fen in test_fens:
+        scores = []
+        for use_transposition_table in [True, False]:
+            bot = NegaMaxAgent("NegaMax", depth=3, selective_search=False,
+                               use_transposition_table=use_transposition_table)
+            bot.make_move(chess.Board(fen))
+            scores.append(bot.last_score)
+            bot.close()
+        if scores[0] != scores[1]:
+            print(f"Transposition table test failed: {fen} scored {scores[0]} with the table, {scores[1]} without")
+            failed += 1
+    if not failed:
+        print("Transposition table test passed")
+
+def heuristics_equivalence_test(games=20, seed=0):
+    # The bitboard, batch and incremental versions of the heuristics must give the same values as
+    # the loop versions, over every position of some random games
+    print("heuristics_equivalence_test")
+    rng = random.Random(seed)
+    pairs = [
+        (piece_count, piece_count_bitboard),
+        (larry_kaufman_piece_sum, larry_kaufman_piece_sum_bitboard),
+        (piece_square_table_eval, piece_square_table_eval_bitboard),
+    ]
+    evaluator = IncrementalEvaluator(material=True, pst=True)
+
+    failed = 0
+    boards = []
+    for _ in range(games):
+        board = chess.Board()
+        evaluator.reset(board)
+        while not board.is_game_over():
+            for player in chess.COLORS:
+                for reference, bitboard in pairs:
+                    if reference(board, player) != bitboard(board, player):
+                        print(f"Heuristics test failed: {bitboard.__name__} differs on {board.fen()}")
+                        failed += 1
+                expected = larry_kaufman_piece_sum(board, player) + piece_square_table_eval(board, player)
+                if evaluator(board, player) != expected:
+                    print(f"Heuristics test failed: IncrementalEvaluator differs on {board.fen()}")
+                    failed += 1
+            if evaluator.pawn_key != pawn_zobrist_hash(board):
+                print(f"Heuristics test failed: IncrementalEvaluator pawn key differs on {board.fen()}")
+                failed += 1
+            boards.append(board.copy(stack=False))
+            # Castling and en passant are rare in random games, so play them whenever they are legal
+            moves = list(board.legal_moves)
+            special = [move for move in moves if board.is_en_passant(move) or board.is_castling(move)]
+            evaluator.push(board, rng.choice(special or moves))
+
+        # Unwinding must restore every score
+        while board.move_stack:
+            evaluator.pop(board)
+            if (evaluator(board, chess.WHITE) != larry_kaufman_piece_sum(board, chess.WHITE) + piece_square_table_eval(board, chess.WHITE)
+                    or evaluator.pawn_key != pawn_zobrist_hash(board)):
+                print(f"Heuristics test failed: IncrementalEvaluator differs after pop on {board.fen()}")
+                failed += 1
+
+    for player in chess.COLORS:
+        for material, pst in [(True, False), (False, True), (True, True)]:
+            scores = batch_evaluate(boards, player, material=material, pst=pst)
+            for board, score in zip(boards, scores):
+                expected = (material and larry_kaufman_piece_sum(board, player)) + (pst and piece_square_table_eval(board, player))
+                if score != expected:
+                    print(f"Heuristics test failed: batch_evaluate(material={material}, pst={pst}) differs on {board.fen()}")
+                    failed += 1
+
+    if not failed:
+        print(f"Heuristics test passed on {len(boards)} positions")
+
 if __name__ == "__main__":
 
     # Bots to test
@@ -92,4 +242,10 @@ if __name__ == "__main__":
         # try:
         # mate_in_2_test(bot)
         # except Exception as e:
-        #     print(e)
\ No newline at end of file
+        #     print(e)
+        bot.close()
+
+    horizon_stalemate_test()
+    move_ordering_test()
+    heuristics_equivalence_test()
+    transposition_table_test()